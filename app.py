@@ -1,14 +1,114 @@
 import streamlit as st
-import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
+import numpy as np
 import urllib.parse
+import html
 import json
 import hashlib
+import base64
+import csv
 from typing import Dict, List
-import math
+import heapq
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import sys
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from functools import cached_property, wraps
 from datetime import datetime
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+# Seconds a fetched catalog is served before a background refresh is started
+CATALOG_TTL_SECONDS = 300
+# Local copy of the last successfully fetched catalog, used for cold starts and outages
+CATALOG_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog_snapshot.sqlite")
+# Catalog worksheets are fetched concurrently; a source slower than the timeout is skipped
+CATALOG_FETCH_WORKERS = 4
+CATALOG_FETCH_TIMEOUT_SECONDS = 30
+# Sheets API requests from every session share one token bucket, kept under Google's per-minute quota
+SHEETS_REQUESTS_PER_MINUTE = 50
+SHEETS_BURST = 10
+# Longest a request waits for a token before it is treated as throttled
+SHEETS_MAX_TOKEN_WAIT_SECONDS = 10
+# Rate-limited or failing requests are retried with exponential backoff and jitter
+SHEETS_MAX_RETRIES = 4
+SHEETS_BACKOFF_BASE_SECONDS = 1.0
+SHEETS_MAX_BACKOFF_SECONDS = 64
+# Durable local record of every generated order
+ORDER_LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "orders.sqlite")
+# Orders unchanged for this long are appended to the orders worksheet, in batches
+ORDER_SETTLE_SECONDS = 120
+ORDER_SYNC_INTERVAL_SECONDS = 15
+ORDER_SYNC_BATCH_SIZE = 50
+ORDER_SYNC_MAX_BACKOFF_SECONDS = 600
+ORDERS_WORKSHEET_HEADERS = ['رقم الطلبية', 'المراجعة', 'تاريخ الطلب', 'عدد الأصناف', 'الإجمالي', 'التفاصيل']
+
+# Stage timing histogram bounds in seconds, and how many recent samples feed the percentiles
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_RECENT_SAMPLES = 1000
+METRICS_EXPORT_INTERVAL_SECONDS = 15
+# INFO includes one structured JSON line per rerun
+METRICS_LOG_LEVEL = "INFO"
+
+# Ranked search returns at most this many products
+RANKED_SEARCH_LIMIT = 50
+# Bulk order lines that no product matches at least this closely are reported as unmatched
+BULK_ORDER_MIN_SCORE = 0.5
+BULK_ORDER_MAX_LINES = 1000
+# Larger numbers next to a product name are read as part of it, e.g. a part number
+BULK_ORDER_MAX_QUANTITY = 999
+# Filtered and grouped result sets kept for reuse across reruns and sessions
+PIPELINE_CACHE_SIZE = 128
+# Products shown per page; separators do not count towards it
+PRODUCTS_PER_PAGE = 15
+PAGE_SIZE_OPTIONS = (15, 30, 60)
+# In the continuous list, at most this many pages of cards are kept on screen
+LIST_MAX_RENDERED_PAGES = 4
+
+# Longest URL-encoded text put in one wa.me link; bigger orders are split into several messages
+WHATSAPP_MAX_ENCODED_LENGTH = 4000
+# Encoded message lines kept across reruns and sessions, so a cart edit only encodes the changed line
+ORDER_LINE_CACHE_SIZE = 4096
+
+# The cart is kept in the page URL as a compact token, so a reload or shared link resumes the order
+CART_QUERY_PARAM = "cart"
+CART_TOKEN_FORMAT = 2
+CART_TOKEN_TAG_BYTES = 6
+# Tokens saved against this many recent catalog versions can still be re-keyed after a refresh
+CART_TOKEN_CATALOG_VERSIONS = 4
+
+# Markers used alongside product ids in a grouped display sequence
+CATEGORY_SEPARATOR = -1
+SUB_CATEGORY_SEPARATOR = -2
+
+SEPARATOR_HTML = {
+    CATEGORY_SEPARATOR: '<div class="category-separator"></div>',
+    SUB_CATEGORY_SEPARATOR: '<div class="sub-category-separator"></div>'
+}
+
+# A whole product card is sent as one element; blank lines would end the HTML block
+PRODUCT_CARD_TEMPLATE = (
+    '{separators}'
+    '<div class="product-card">'
+    '<div class="product-header">'
+    '<div class="product-name">{name}</div>'
+    '<div class="product-origin">{origin}</div>'
+    '</div>'
+    '<div class="price-section">'
+    '<div><div class="subtotal-label">السعر</div><strong>{price} ج.م</strong></div>'
+    '<div><div class="subtotal-label">الإجمالي الجزئي</div><strong>{subtotal} ج.م</strong></div>'
+    '</div>'
+    '<div class="quantity-controls"><div class="qty-display">{quantity}</div></div>'
+    '</div>'
+)
 
 # Configure page
 st.set_page_config(
@@ -223,242 +323,2030 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Initialize session state
-if 'cart' not in st.session_state:
-    st.session_state.cart = {}
-if 'current_page' not in st.session_state:
-    st.session_state.current_page = 1
-if 'show_order_form' not in st.session_state:
-    st.session_state.show_order_form = False
-if 'search_query' not in st.session_state:
-    st.session_state.search_query = ""
+class Metrics:
+    """Process-wide stage timings and counters.
 
-@st.cache_data
-def load_google_sheet():
-    """Load data from Google Sheets with new structure: الفئة, البند, المنشأ, السعر"""
+    Every span feeds a Prometheus-style histogram for its stage and a window
+    of recent samples used for percentiles. Spans timed on a script thread
+    between ``begin_rerun`` and ``end_rerun`` are also returned for that
+    rerun. Counters kept by other objects, such as cache hits, are read
+    through registered collectors when exporting.
+    """
+
+    def __init__(self, buckets: tuple = METRICS_BUCKETS, recent_samples: int = METRICS_RECENT_SAMPLES):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._bucket_counts = {}
+        self._sums = defaultdict(float)
+        self._counts = defaultdict(int)
+        self._recent = defaultdict(lambda: deque(maxlen=recent_samples))
+        self._counters = defaultdict(int)
+        self._collectors = []
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            counts = self._bucket_counts.setdefault(stage, [0] * len(self.buckets))
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[index] += 1
+            self._sums[stage] += seconds
+            self._counts[stage] += 1
+            self._recent[stage].append(seconds)
+        spans = getattr(self._local, 'spans', None)
+        if spans is not None:
+            spans.append((stage, seconds))
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def add_collector(self, collect):
+        """Register a callable returning ``{counter_name: value}`` to include in exports"""
+        with self._lock:
+            self._collectors.append(collect)
+
+    @property
+    def in_rerun(self) -> bool:
+        return getattr(self._local, 'spans', None) is not None
+
+    def begin_rerun(self):
+        self._local.spans = []
+
+    def end_rerun(self) -> List[tuple]:
+        """Return the (stage, seconds) spans timed on this thread since ``begin_rerun``"""
+        spans = getattr(self._local, 'spans', None) or []
+        self._local.spans = None
+        return spans
+
+    def counters(self) -> Dict[str, float]:
+        with self._lock:
+            values = dict(self._counters)
+            collectors = list(self._collectors)
+        for collect in collectors:
+            values.update(collect())
+        return values
+
+    def percentiles(self) -> Dict[str, tuple]:
+        """(p50, p95, p99, sample count) in seconds per stage, over the recent window"""
+        with self._lock:
+            recent = {stage: list(samples) for stage, samples in self._recent.items()}
+        return {stage: tuple(np.percentile(samples, [50, 95, 99]).tolist()) + (len(samples),)
+                for stage, samples in recent.items()}
+
+    def prometheus_text(self) -> str:
+        """Render the histograms and counters in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = [(stage, list(counts), self._sums[stage], self._counts[stage])
+                          for stage, counts in self._bucket_counts.items()]
+        lines = ['# TYPE app_stage_seconds histogram']
+        for stage, counts, total, count in histograms:
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'app_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {bucket_count}')
+            lines.append(f'app_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'app_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'app_stage_seconds_count{{stage="{stage}"}} {count}')
+        for name, value in sorted(self.counters().items()):
+            lines.append(f'# TYPE app_{name} counter')
+            lines.append(f'app_{name} {value}')
+        return "\n".join(lines) + "\n"
+
+class MetricsExporter:
+    """Background thread writing the Prometheus text to a file and/or serving it over HTTP.
+
+    The file is replaced atomically, so it suits node_exporter's textfile
+    collector; the HTTP server answers ``GET /metrics`` on ``port``.
+    """
+
+    def __init__(self, metrics: Metrics, path: str = None, port: int = None,
+                 interval_seconds: float = METRICS_EXPORT_INTERVAL_SECONDS):
+        self.metrics = metrics
+        self.path = path
+        self.port = port
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.path:
+            threading.Thread(target=self._write_loop, name="metrics-export", daemon=True).start()
+        if self.port:
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] != '/metrics':
+                        self.send_error(404)
+                        return
+                    body = metrics.prometheus_text().encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            server = ThreadingHTTPServer(('', self.port), Handler)
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def write_once(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.metrics.prometheus_text())
+        os.replace(tmp_path, self.path)
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.write_once()
+            except OSError as e:
+                logger.warning("Could not write metrics to %s: %s", self.path, e)
+
+def read_metrics_settings() -> Dict:
+    """The [metrics] secrets, empty when there is no secrets file at all"""
+    # Metrics run on the landing page, which must not depend on secrets being set up
     try:
-        # Get credentials from Streamlit secrets
-        credentials_dict = dict(st.secrets["gcp_service_account"])
-        # Define the required scopes for Google Sheets
-        scopes = [
-            'https://www.googleapis.com/auth/spreadsheets.readonly', 
-            'https://www.googleapis.com/auth/drive.readonly' 
-        ]
-        # Create credentials with proper scopes
-        credentials = Credentials.from_service_account_info(credentials_dict, scopes=scopes)
-        # Connect to Google Sheets
-        gc = gspread.authorize(credentials)
-        sheet_id = st.secrets["google"]["sheet_id"]
-        sheet = gc.open_by_key(sheet_id).sheet1
-        
-        # Get all values, including empty rows
-        all_values = sheet.get_all_values()
-        headers = all_values[0]
-        data_rows = all_values[1:]
-        
-        processed_data = []
-        global_product_index = 0
-        
-        for row in data_rows:
-            if not any(cell.strip() for cell in row):
-                processed_data.append({
-                    'type': 'sub_category_separator',
-                    'category': ''
-                })
-            else:
-                product_data = {}
-                for i, header in enumerate(headers):
-                    value = row[i]
-                    if header == 'السعر':
-                        try:
-                            value = float(value)
-                        except ValueError:
-                            value = 0.0
-                    product_data[header] = value
+        return st.secrets.get("metrics", {})
+    except FileNotFoundError:
+        return {}
+
+def configure_logging(level: str):
+    """Send this app's log records, including the per-rerun JSON lines, to stderr at ``level``"""
+    # `streamlit run` leaves the root logger at WARNING without a handler of its own
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    try:
+        logger.setLevel(str(level).upper())
+    except ValueError:
+        logger.setLevel(METRICS_LOG_LEVEL)
+        logger.warning("Unknown log level %r, using %s", level, METRICS_LOG_LEVEL)
+
+@st.cache_resource
+def get_metrics() -> Metrics:
+    """Create the metrics registry shared by every session, starting any configured export"""
+    metrics_settings = read_metrics_settings()
+    configure_logging(metrics_settings.get("log_level", METRICS_LOG_LEVEL))
+    metrics = Metrics()
+    path = metrics_settings.get("prometheus_path")
+    port = metrics_settings.get("port")
+    if path or port:
+        try:
+            MetricsExporter(
+                metrics, path, int(port) if port else None,
+                float(metrics_settings.get("export_interval_seconds", METRICS_EXPORT_INTERVAL_SECONDS))
+            ).start()
+        except OSError as e:
+            logger.warning("Could not start the metrics export: %s", e)
+    return metrics
+
+def log_rerun(event: str, total_seconds: float, spans: List[tuple]):
+    """Record a rerun's total time under ``event`` and log its spans as one JSON line"""
+    get_metrics().observe(event, total_seconds)
+    logger.info(json.dumps({
+        "event": event,
+        "order_id": st.session_state.cart.order_id,
+        "total_ms": round(total_seconds * 1000, 2),
+        "spans": [[stage, round(seconds * 1000, 2)] for stage, seconds in spans]
+    }, ensure_ascii=False))
+
+def timed_fragment(fragment):
+    """Time and log a fragment's own reruns; during a full rerun ``main`` already does"""
+    @wraps(fragment)
+    def run(*args, **kwargs):
+        metrics = get_metrics()
+        if metrics.in_rerun:
+            return fragment(*args, **kwargs)
+        metrics.begin_rerun()
+        started = time.perf_counter()
+        try:
+            return fragment(*args, **kwargs)
+        finally:
+            log_rerun("fragment", time.perf_counter() - started, metrics.end_rerun())
+    return run
+
+class SheetsThrottled(Exception):
+    """A Sheets API request was not made, or kept being refused, because of the quota"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Google Sheets quota exhausted, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+def _is_quota_error(error: Exception) -> bool:
+    if isinstance(error, SheetsThrottled):
+        return True
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) == 429
+
+def _is_retryable_error(error: Exception) -> bool:
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) in (429, 500, 502, 503, 504)
+
+class SheetsQuotaGuard:
+    """Process-wide token bucket and retry policy for Google Sheets API requests.
+
+    Every gspread call that makes a request goes through ``call``. A 429 from
+    Google pauses all callers for the backoff period, not just the one that
+    got it. When no token is available in time, or the retries run out on
+    429s, ``SheetsThrottled`` is raised so callers can keep serving what they
+    already have.
+    """
+
+    def __init__(self, requests_per_minute: float = SHEETS_REQUESTS_PER_MINUTE, burst: int = SHEETS_BURST,
+                 max_retries: int = SHEETS_MAX_RETRIES, max_token_wait: float = SHEETS_MAX_TOKEN_WAIT_SECONDS):
+        self.rate = requests_per_minute / 60.0
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_token_wait = max_token_wait
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self.throttled = 0
+        self.retries = 0
+
+    def _take(self) -> float:
+        """Take a token, or return how many seconds until one is available"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def _pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        """Wait for a token, raising ``SheetsThrottled`` if it would take too long"""
+        deadline = time.monotonic() + self.max_token_wait
+        while True:
+            wait_seconds = self._take()
+            if not wait_seconds:
+                return
+            if time.monotonic() + wait_seconds > deadline:
+                self.throttled += 1
+                raise SheetsThrottled(wait_seconds)
+            time.sleep(wait_seconds)
+
+    def call(self, fn, *args, **kwargs):
+        """Make one rate-limited request, retrying 429s and server errors with backoff"""
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not _is_retryable_error(e):
+                    raise
+                backoff = min(SHEETS_BACKOFF_BASE_SECONDS * 2 ** attempt, SHEETS_MAX_BACKOFF_SECONDS)
+                backoff += random.uniform(0, SHEETS_BACKOFF_BASE_SECONDS)
+                if _is_quota_error(e):
+                    self._pause(backoff)
+                if attempt == self.max_retries:
+                    if _is_quota_error(e):
+                        self.throttled += 1
+                        raise SheetsThrottled(backoff) from e
+                    raise
+                self.retries += 1
+                logger.info("Sheets request failed (%s), retrying in %.1fs", e, backoff)
+                time.sleep(backoff)
+
+@st.cache_resource
+def get_sheets_guard() -> SheetsQuotaGuard:
+    """Create the quota guard shared by every Sheets API caller in this process"""
+    google_settings = st.secrets.get("google", {})
+    guard = SheetsQuotaGuard(
+        float(google_settings.get("requests_per_minute", SHEETS_REQUESTS_PER_MINUTE)),
+        int(google_settings.get("request_burst", SHEETS_BURST))
+    )
+    get_metrics().add_collector(lambda: {
+        'sheets_retries_total': guard.retries,
+        'sheets_throttled_total': guard.throttled
+    })
+    return guard
+
+def authorize_sheets_client(credentials_dict: Dict):
+    """Create a read-only gspread client from service account info"""
+    # Imported here so the landing page does not wait for them
+    import gspread
+    from google.oauth2.service_account import Credentials
+    
+    # Define the required scopes for Google Sheets
+    scopes = [
+        'https://www.googleapis.com/auth/spreadsheets.readonly', 
+        'https://www.googleapis.com/auth/drive.readonly' 
+    ]
+    # Create credentials with proper scopes
+    credentials = Credentials.from_service_account_info(credentials_dict, scopes=scopes)
+    # Connect to Google Sheets
+    return gspread.authorize(credentials)
+
+def fetch_sheet_values(gc, guard: SheetsQuotaGuard, sheet_id: str, worksheet: str = None) -> List[List[str]]:
+    """Fetch the raw cell values of a worksheet (the first one by default), including empty rows"""
+    spreadsheet = guard.call(gc.open_by_key, sheet_id)
+    if worksheet:
+        sheet = guard.call(spreadsheet.worksheet, worksheet)
+    else:
+        sheet = guard.call(lambda: spreadsheet.sheet1)
+    return guard.call(sheet.get_all_values)
+
+def catalog_sources(google_settings) -> List[tuple]:
+    """Return the (sheet_id, worksheet) pairs the catalog is assembled from, in order.
+
+    ``worksheets`` lists tabs of the main sheet to read instead of its first
+    tab; ``sources`` adds tabs from other spreadsheets, e.g. other branches.
+    """
+    sheet_id = google_settings["sheet_id"]
+    worksheets = list(google_settings.get("worksheets", []))
+    sources = [(sheet_id, title) for title in worksheets] or [(sheet_id, None)]
+    for source in google_settings.get("sources", []):
+        sources.append((source.get("sheet_id", sheet_id), source.get("worksheet")))
+    return sources
+
+@dataclass(frozen=True, eq=False)
+class Catalog:
+    """Immutable, columnar product catalog built once per sheet version.
+
+    Product ``i`` is row ``i`` of every column and ``i`` is its ``global_id``.
+    Origins and categories are categorical: per-product integer codes into
+    tuples of interned labels, in order of first appearance. The instance is
+    shared read-only by every session in the process.
+
+    ``separator_positions`` holds, for every blank sheet row, the id of the
+    product that follows it. ``rejected_rows`` lists (sheet row, reason) pairs
+    of rows that could not be parsed.
+    """
+    version: str
+    names: np.ndarray
+    origin_codes: np.ndarray
+    origin_labels: tuple
+    category_codes: np.ndarray
+    category_labels: tuple
+    prices: np.ndarray
+    separator_positions: np.ndarray
+    rejected_rows: tuple = ()
+    diff: 'CatalogDiff' = None
+
+    def __len__(self):
+        return len(self.prices)
+
+    def origin(self, product_id: int) -> str:
+        return self.origin_labels[self.origin_codes[product_id]]
+
+    def category(self, product_id: int) -> str:
+        return self.category_labels[self.category_codes[product_id]]
+
+    def origin_code(self, origin: str) -> int:
+        """Code of an origin label, or -1 when no product has it"""
+        try:
+            return self.origin_labels.index(origin)
+        except ValueError:
+            return -1
+
+    def origin_values(self) -> List[str]:
+        """Origin of every product, sharing the interned label strings"""
+        return [self.origin_labels[code] for code in self.origin_codes.tolist()]
+
+    def category_values(self) -> List[str]:
+        """Category of every product, sharing the interned label strings"""
+        return [self.category_labels[code] for code in self.category_codes.tolist()]
+
+    @cached_property
+    def row_hashes(self) -> np.ndarray:
+        """Per-process 64-bit hash of every product row's category, name, origin and price"""
+        return _hash_rows(zip(self.category_values(), self.names.tolist(),
+                              self.origin_values(), self.prices.tolist()))
+
+    @cached_property
+    def sku_hashes(self) -> np.ndarray:
+        """Per-process 64-bit hash of every product's (name, origin), which identifies it across versions"""
+        return _hash_rows(zip(self.names.tolist(), self.origin_values()))
+
+    @property
+    def origin_options(self) -> List[str]:
+        """Distinct origins in order of first appearance"""
+        return list(self.origin_labels)
+
+    @cached_property
+    def sku_ids(self) -> Dict:
+        """Map each SKU hash to the id of its first product in this version"""
+        return dict(zip(self.sku_hashes[::-1].tolist(), range(len(self) - 1, -1, -1)))
+
+    @cached_property
+    def search_index(self) -> 'SearchIndex':
+        """Search index over the product names, built on first use"""
+        return SearchIndex(self.names.tolist())
+
+def _hash_rows(rows) -> np.ndarray:
+    # Python's tuple hash is salted per process, which is fine: diffs never leave the process
+    hashes = np.fromiter((hash(row) for row in rows), dtype=np.int64)
+    hashes.setflags(write=False)
+    return hashes
+
+@dataclass(frozen=True, eq=False)
+class CatalogDiff:
+    """Row-level changes from one catalog version to the next.
+
+    Products are matched by (name, origin). ``id_map`` gives the new id of
+    every old id, or -1 for a product that is gone; ``price_changed`` holds
+    new ids. ``layout_unchanged`` means only prices changed, so id-based
+    structures of the old version stay valid.
+    """
+    old_version: str
+    new_version: str
+    id_map: np.ndarray
+    price_changed: np.ndarray
+    layout_unchanged: bool
+
+def diff_catalogs(old: 'Catalog', new: 'Catalog') -> CatalogDiff:
+    """Diff two catalog versions using their row hashes"""
+    # First occurrence of each (name, origin) on both sides
+    old_skus, old_first = np.unique(old.sku_hashes, return_index=True)
+    new_skus, new_first = np.unique(new.sku_hashes, return_index=True)
+    _, old_match, new_match = np.intersect1d(old_skus, new_skus, assume_unique=True, return_indices=True)
+    old_ids, new_ids = old_first[old_match], new_first[new_match]
+    
+    row_changed = old.row_hashes[old_ids] != new.row_hashes[new_ids]
+    price_changed = new_ids[row_changed & (old.prices[old_ids] != new.prices[new_ids])]
+    # Repeated (name, origin) rows map to the first new row with that SKU
+    sku_new_ids = np.full(len(old_skus), -1, dtype=np.int64)
+    sku_new_ids[old_match] = new_ids
+    id_map = sku_new_ids[np.searchsorted(old_skus, old.sku_hashes)]
+    
+    layout_unchanged = (
+        len(old) == len(new) and np.array_equal(id_map, np.arange(len(old)))
+        and old.category_labels == new.category_labels
+        and np.array_equal(old.category_codes, new.category_codes)
+        and np.array_equal(old.separator_positions, new.separator_positions)
+    )
+    return CatalogDiff(
+        old_version=old.version,
+        new_version=new.version,
+        id_map=id_map,
+        price_changed=np.sort(price_changed),
+        layout_unchanged=layout_unchanged
+    )
+
+def derive_catalog(previous: 'Catalog', catalog: 'Catalog', pipeline_cache: 'LRUCache' = None) -> 'Catalog':
+    """Attach the diff from ``previous`` to ``catalog`` and reuse what did not change.
+
+    When only prices changed, the search index, lookups and cached result sets
+    of the previous version are carried over instead of being rebuilt.
+    """
+    if previous is None:
+        return catalog
+    if previous.version == catalog.version:
+        return previous
+        
+    diff = diff_catalogs(previous, catalog)
+    derived = replace(catalog, diff=diff)
+    carried = [(catalog, name) for name in ('row_hashes', 'sku_hashes')]
+    if diff.layout_unchanged:
+        carried += [(previous, name) for name in ('search_index', 'sku_ids')]
+        if pipeline_cache is not None:
+            pipeline_cache.copy_version(previous.version, derived.version)
+    for source, name in carried:
+        if name in source.__dict__:
+            derived.__dict__[name] = source.__dict__[name]
+    return derived
+
+# Diacritics, Quranic marks and tatweel are dropped before matching
+_ARABIC_IGNORED_CHARS = re.compile('[\u0610-\u061a\u0640\u064b-\u065f\u0670\u06d6-\u06ed]')
+_ARABIC_NORMALIZATION = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)}
+})
+_SEARCH_TOKEN = re.compile(r'\w+')
+_HAS_DIGIT = re.compile(r'\d')
+
+# Prices may use Arabic-Indic digits, either decimal mark, thousands separators and a currency
+_PRICE_TRANSLATION = str.maketrans({
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)},
+    '٫': '.', '٬': ',', '،': ',', '\u00a0': ' '
+})
+# Thousands separators are only accepted between whole groups of three digits
+_GROUPED_PRICE = re.compile(r'\d{1,3}(?:,\d{3})+(?:\.\d+)?')
+_PLAIN_PRICE = re.compile(r'\d*\.?\d+|\d+\.')
+_CURRENCY_MARKERS = ('ج.م', 'جم', 'جنيه', 'EGP', 'egp', 'LE', 'L.E')
+
+# Bulk order lines: a quantity after or before the name, optionally marked with x, × or *
+_DIGIT_TRANSLATION = str.maketrans({
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)}
+})
+_TRAILING_QUANTITY = re.compile(r'^(?P<name>.*?\S)(?:\s*[×*]\s*|\s+(?:x\s*)?)(?P<quantity>\d+)$', re.IGNORECASE)
+_MARKED_LEADING_QUANTITY = re.compile(r'^(?P<quantity>\d+)\s*(?:[×*]\s*|x\s+)(?P<name>\S.*)$', re.IGNORECASE)
+_LEADING_QUANTITY = re.compile(r'^(?P<quantity>\d+)\s+(?P<name>\S.*)$')
+_BULK_ORDER_DELIMITERS = '\t;,،'
+_BULK_ORDER_HEADERS = {'الصنف', 'البند', 'المنتج', 'الكميه', 'العدد', 'item', 'name', 'product', 'qty', 'quantity'}
+
+def normalize_search_text(text: str) -> str:
+    """Normalize Arabic letter variants, digits and case into space separated tokens"""
+    text = _ARABIC_IGNORED_CHARS.sub('', text).translate(_ARABIC_NORMALIZATION).lower()
+    return ' '.join(_SEARCH_TOKEN.findall(text))
+
+class SearchIndex:
+    """Two-level inverted index over normalized product names.
+
+    Names are split into distinct words, each with a postings list of the
+    products using it, and the words are indexed by their 1-3 character
+    n-grams. A query token matches every word containing it as a substring,
+    and every query token has to match for a product to be returned.
+    """
+
+    MAX_GRAM = 3
+
+    def __init__(self, names: List[str]):
+        self.names = [normalize_search_text(name) for name in names]
+        word_ids = {}
+        word_postings = []
+        for product_id, name in enumerate(self.names):
+            for word in set(name.split()):
+                word_id = word_ids.setdefault(word, len(word_ids))
+                if word_id == len(word_postings):
+                    word_postings.append([])
+                word_postings[word_id].append(product_id)
                 
-                processed_data.append({
-                    'type': 'product',
-                    'data': product_data,
-                    'global_id': global_product_index
-                })
-                global_product_index += 1
-        
-        df = pd.DataFrame([item['data'] for item in processed_data if item['type'] == 'product'])
-        required_columns = ['الفئة', 'البند', 'المنشأ', 'السعر']
-        for col in required_columns:
-            if col not in df.columns:
-                st.error(f"Missing required column: {col}")
-                return pd.DataFrame()
+        gram_postings = defaultdict(list)
+        for word, word_id in word_ids.items():
+            for gram in self._word_grams(word):
+                gram_postings[gram].append(word_id)
                 
-        df = df.dropna(subset=['البند'])
-        df = df[df['البند'] != '']
-        df = df.sort_values(['الفئة', 'البند'])
+        self.words = list(word_ids)
+        self._word_postings = [np.array(ids, dtype=np.int32) for ids in word_postings]
+        self._gram_postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in gram_postings.items()}
+        self._short_token_matches = {}
+        self._all_ids = np.arange(len(self.names), dtype=np.int32)
+        self._no_ids = np.empty(0, dtype=np.int32)
+
+    @classmethod
+    def _word_grams(cls, word: str) -> set:
+        return {word[i:i + n] for n in range(1, cls.MAX_GRAM + 1) for i in range(len(word) - n + 1)}
+
+    def search(self, query: str) -> np.ndarray:
+        """Return the sorted ids of products whose name contains every query token"""
+        tokens = normalize_search_text(query).split()
+        if not tokens:
+            return self._all_ids
+            
+        result = None
+        # Longest tokens first, they are usually the most selective
+        for token in sorted(set(tokens), key=len, reverse=True):
+            ids = self._token_matches(token)
+            result = ids if result is None else np.intersect1d(result, ids, assume_unique=True)
+            if not len(result):
+                break
+        return result
+
+    def matching_words(self, token: str) -> np.ndarray:
+        """Return the ids of indexed words containing ``token``"""
+        if len(token) <= self.MAX_GRAM:
+            return self._gram_postings.get(token, self._no_ids)
+            
+        grams = {token[i:i + self.MAX_GRAM] for i in range(len(token) - self.MAX_GRAM + 1)}
+        lists = sorted((self._gram_postings.get(gram, self._no_ids) for gram in grams), key=len)
+        candidates = lists[0]
+        for ids in lists[1:]:
+            if not len(candidates):
+                break
+            candidates = np.intersect1d(candidates, ids, assume_unique=True)
+            
+        words = self.words
+        return np.array([w for w in candidates.tolist() if token in words[w]], dtype=np.int32)
+
+    # A query token counts towards a word once their trigram similarity reaches this
+    MIN_WORD_SIMILARITY = 0.25
+    MIN_RANK_SCORE = 0.35
+
+    def rank(self, query: str, limit: int = RANKED_SEARCH_LIMIT, allowed: np.ndarray = None,
+             min_score: float = MIN_RANK_SCORE) -> np.ndarray:
+        """Return up to ``limit`` product ids ordered by how closely they match ``query``.
+
+        Each query token is scored against every distinct word of the catalog:
+        1 when it is a substring of the word, otherwise the trigram similarity
+        of the padded pair, which tolerates typos. Adjacent name words that both
+        hold digits are also scored joined, so part numbers typed without their
+        dash still match. A product scores the mean, over the query tokens, of
+        its best matching word. ``allowed`` is an optional boolean mask
+        restricting which products may be returned, and products scoring below
+        ``min_score`` are left out.
+        """
+        tokens = sorted(set(normalize_search_text(query).split()))
+        if not tokens:
+            return self._no_ids
+            
+        word_products = self._rank_vocabulary[0]
+        scores = np.zeros(len(self.names))
+        for token in tokens:
+            similarity = self._word_similarity(token)
+            words = np.flatnonzero(similarity >= self.MIN_WORD_SIMILARITY)
+            if not len(words):
+                continue
+            postings = [word_products[w] for w in words.tolist()]
+            token_scores = np.zeros(len(self.names))
+            np.maximum.at(token_scores, np.concatenate(postings),
+                          np.repeat(similarity[words], [len(ids) for ids in postings]))
+            scores += token_scores
+        scores /= len(tokens)
+        if allowed is not None:
+            scores[~allowed] = 0
+            
+        candidates = np.flatnonzero(scores >= min_score).tolist()
+        top = heapq.nlargest(limit, candidates, key=scores.__getitem__)
+        return np.array(top, dtype=np.int32)
+
+    def _word_similarity(self, token: str) -> np.ndarray:
+        """Similarity of ``token`` to every word of the ranking vocabulary"""
+        word_products, gram_postings, gram_counts = self._rank_vocabulary
+        grams = self._padded_grams(token)
+        hits = [gram_postings[gram] for gram in grams if gram in gram_postings]
+        if hits:
+            shared = np.bincount(np.concatenate(hits), minlength=len(word_products))
+        else:
+            shared = np.zeros(len(word_products), dtype=np.int64)
+        similarity = shared / (len(grams) + gram_counts - shared)
+        # The catalog's own words come first in the vocabulary
+        similarity[self.matching_words(token)] = 1.0
+        return similarity
+
+    @staticmethod
+    def _padded_grams(word: str) -> set:
+        padded = f"  {word} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    @cached_property
+    def _rank_vocabulary(self):
+        """Product postings and padded trigram postings of every word, plus joined part numbers.
+
+        Built by ``warm`` after each fetch, or else on the first ranked query.
+        """
+        word_products = list(self._word_postings)
+        compounds = defaultdict(list)
+        for product_id, name in enumerate(self.names):
+            words = name.split()
+            joined = {left + right for left, right in zip(words, words[1:])
+                      if _HAS_DIGIT.search(left) and _HAS_DIGIT.search(right)}
+            for compound in joined:
+                compounds[compound].append(product_id)
+        vocabulary = self.words + list(compounds)
+        word_products += [np.array(ids, dtype=np.int32) for ids in compounds.values()]
         
-        return processed_data
-    except Exception as e:
-        st.error(f"Error loading Google Sheet: {str(e)}")
-        return []
+        gram_postings = defaultdict(list)
+        gram_counts = np.empty(len(vocabulary), dtype=np.int32)
+        for word_id, word in enumerate(vocabulary):
+            grams = self._padded_grams(word)
+            gram_counts[word_id] = len(grams)
+            for gram in grams:
+                gram_postings[gram].append(word_id)
+        gram_postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in gram_postings.items()}
+        return word_products, gram_postings, gram_counts
 
-def group_products_by_category(data_list):
-    """Group products by category and add separators, handling sub-category separators"""
-    if not data_list:
-        return []
+    def warm(self):
+        """Build the ranking vocabulary and exact-name lookup ahead of the first query that needs them"""
+        _ = self._rank_vocabulary, self._name_ids
+
+    def exact_matches(self, query: str) -> List[int]:
+        """Return the ids of products whose normalized name equals the normalized query"""
+        return self._name_ids.get(normalize_search_text(query), [])
+
+    @cached_property
+    def _name_ids(self) -> Dict[str, List[int]]:
+        """Product ids by normalized name"""
+        name_ids = defaultdict(list)
+        for product_id, name in enumerate(self.names):
+            name_ids[name].append(product_id)
+        return dict(name_ids)
+
+    def _token_matches(self, token: str) -> np.ndarray:
+        cached = self._short_token_matches.get(token)
+        if cached is not None:
+            return cached
+            
+        word_ids = self.matching_words(token).tolist()
+        if not word_ids:
+            ids = self._no_ids
+        elif len(word_ids) == 1:
+            ids = self._word_postings[word_ids[0]]
+        else:
+            ids = np.unique(np.concatenate([self._word_postings[w] for w in word_ids]))
+            
+        # Short tokens match many words; there are few of them, so keep their results
+        if len(token) <= self.MAX_GRAM:
+            self._short_token_matches[token] = ids
+        return ids
+
+def _frozen_array(values, dtype) -> np.ndarray:
+    array = np.array(values, dtype=dtype)
+    array.setflags(write=False)
+    return array
+
+def factorize(values):
+    """Split values into int32 codes and a tuple of interned labels in order of first appearance"""
+    values = np.asarray(values, dtype=str)
+    if not len(values):
+        return _frozen_array([], np.int32), ()
+    uniques, first_index, inverse = np.unique(values, return_index=True, return_inverse=True)
+    order = np.argsort(first_index)
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    codes = rank[inverse.reshape(-1)]
+    codes.setflags(write=False)
+    return codes, tuple(sys.intern(str(label)) for label in uniques[order].tolist())
+
+def build_catalog(version: str, categories, names, origins, prices, separator_positions,
+                  rejected_rows: tuple = ()) -> Catalog:
+    """Build an immutable catalog from per-product column values"""
+    category_codes, category_labels = factorize(categories)
+    origin_codes, origin_labels = factorize(origins)
+    return Catalog(
+        version=version,
+        names=_frozen_array(names, object),
+        origin_codes=origin_codes,
+        origin_labels=origin_labels,
+        category_codes=category_codes,
+        category_labels=category_labels,
+        prices=_frozen_array(prices, np.float64),
+        separator_positions=_frozen_array(separator_positions, np.int32),
+        rejected_rows=tuple(rejected_rows)
+    )
+
+def _clean_price(text: str) -> str:
+    """Return a price as a plain decimal string, or '' when it is ambiguous or not a number"""
+    text = text.translate(_PRICE_TRANSLATION)
+    for marker in _CURRENCY_MARKERS:
+        text = text.replace(marker, '')
+    # Spaces between digit groups separate thousands, like commas
+    text = ','.join(text.split())
+    if _GROUPED_PRICE.fullmatch(text):
+        return text.replace(',', '')
+    return text if _PLAIN_PRICE.fullmatch(text) else ''
+
+def parse_prices(values: np.ndarray):
+    """Convert a column of price strings to floats in bulk.
+
+    Handles Arabic-Indic digits, thousands separators and currency suffixes;
+    returns the prices and a mask of the values that were valid numbers.
+    Separators that do not split whole groups of three digits, as in "1,5"
+    or "1.250,50", make the value invalid rather than guessed at.
+    """
+    cleaned = values.astype(str)
+    valid = np.char.isdecimal(np.char.replace(cleaned, '.', '', count=1))
+    # Only values that are not already plain numbers go through the slower clean-up
+    messy = np.flatnonzero(~valid & (np.char.str_len(cleaned) > 0))
+    if len(messy):
+        fixed = np.array([_clean_price(value) for value in cleaned[messy].tolist()], dtype=object)
+        cleaned = cleaned.astype(object)
+        cleaned[messy] = fixed
+        cleaned = cleaned.astype(str)
+        valid[messy] = fixed != ''
+    prices = np.zeros(len(values), dtype=np.float64)
+    prices[valid] = cleaned[valid].astype(np.float64)
+    return prices, valid
+
+def parse_sheet_values(all_values: List[List[str]]) -> Catalog:
+    """Parse sheet values with new structure: الفئة, البند, المنشأ, السعر"""
+    if not all_values:
+        raise ValueError("The sheet is empty")
+    headers = [header.strip() for header in all_values[0]]
+    data_rows = all_values[1:]
+    
+    # Validate the schema before touching any data
+    required_columns = ['الفئة', 'البند', 'المنشأ', 'السعر']
+    missing = [col for col in required_columns if col not in headers]
+    if missing:
+        raise ValueError(f"Missing required column: {', '.join(missing)}")
+    column_indexes = [headers.index(col) for col in required_columns]
+    
+    # Copy out only the required columns, so wide free-text columns never reach numpy
+    categories, names, origins, raw_prices = (
+        np.char.strip(np.array([row[index] if index < len(row) else '' for row in data_rows], dtype=str))
+        for index in column_indexes
+    )
+    
+    filled = np.zeros(len(data_rows), dtype=bool)
+    for column in (categories, names, origins, raw_prices):
+        filled |= np.char.str_len(column) > 0
+    has_name = np.char.str_len(names) > 0
+    prices, valid_price = parse_prices(raw_prices)
+    accepted = filled & has_name & valid_price
+    
+    # Blank rows become separators before the next accepted product
+    products_before = np.cumsum(accepted) - accepted
+    separator_positions = products_before[~filled]
+    
+    # Version the parsed content, so whitespace-only edits do not count as a change
+    digest = hashlib.sha1()
+    for column in (categories[accepted], names[accepted], origins[accepted], prices[accepted], separator_positions):
+        digest.update(column.dtype.str.encode('ascii'))
+        digest.update(column.tobytes())
+        
+    rejected_rows = tuple(
+        (row_index + 2, "اسم البند فارغ" if not has_name[row_index] else f"سعر غير صالح: {raw_prices[row_index]}")
+        for row_index in np.flatnonzero(filled & ~accepted).tolist()
+    )
+    if rejected_rows:
+        logger.warning("Rejected %d catalog rows, first ones: %s", len(rejected_rows), rejected_rows[:5])
+        
+    return build_catalog(
+        digest.hexdigest()[:16],
+        categories[accepted],
+        names[accepted].astype(object),
+        origins[accepted],
+        prices[accepted],
+        separator_positions,
+        rejected_rows
+    )
+
+def merge_catalogs(catalogs: List['Catalog']) -> 'Catalog':
+    """Concatenate per-source catalogs, separating sources with a sub-category separator"""
+    if len(catalogs) == 1:
+        return catalogs[0]
+        
+    separator_positions = []
+    offset = 0
+    for catalog in catalogs:
+        if offset:
+            separator_positions.append(offset)
+        separator_positions.extend((catalog.separator_positions + offset).tolist())
+        offset += len(catalog)
         
-    grouped_products = []
-    current_category = None
+    version = hashlib.sha1('|'.join(catalog.version for catalog in catalogs).encode('utf-8')).hexdigest()[:16]
+    return build_catalog(
+        version,
+        sum((catalog.category_values() for catalog in catalogs), []),
+        np.concatenate([catalog.names for catalog in catalogs]),
+        sum((catalog.origin_values() for catalog in catalogs), []),
+        np.concatenate([catalog.prices for catalog in catalogs]),
+        separator_positions,
+        sum((catalog.rejected_rows for catalog in catalogs), ())
+    )
+
+def fetch_catalog(credentials_dict: Dict, sources: List[tuple], guard: SheetsQuotaGuard, metrics: Metrics,
+                  last_good: Dict = None, require_all: bool = False) -> 'Catalog':
+    """Fetch and parse every catalog source concurrently and merge them.
+
+    A source that fails or is still running after the timeout is replaced by
+    its entry in ``last_good`` (updated in place), or left out; only when no
+    source is available at all, or with ``require_all`` when any source is
+    missing, is an error raised.
+    """
+    last_good = {} if last_good is None else last_good
+    gc = authorize_sheets_client(credentials_dict)
     
-    for item in data_list:
-        if item['type'] == 'product':
-            product = item['data']
-            category = product['الفئة']
+    def fetch_source(source):
+        with metrics.span("fetch"):
+            values = fetch_sheet_values(gc, guard, *source)
+        with metrics.span("parse"):
+            return parse_sheet_values(values)
+        
+    executor = ThreadPoolExecutor(max_workers=min(CATALOG_FETCH_WORKERS, len(sources)),
+                                  thread_name_prefix="catalog-fetch")
+    try:
+        futures = [executor.submit(fetch_source, source) for source in sources]
+        wait(futures, timeout=CATALOG_FETCH_TIMEOUT_SECONDS)
+    finally:
+        # Do not wait for stragglers; their results are simply ignored
+        executor.shutdown(wait=False, cancel_futures=True)
+        
+    catalogs = []
+    first_error = None
+    missing = 0
+    for source, future in zip(sources, futures):
+        finished = future.done() and not future.cancelled()
+        if finished and future.exception() is None:
+            last_good[source] = future.result()
+        else:
+            error = future.exception() if finished else TimeoutError("Timed out fetching worksheet")
+            first_error = first_error or error
+            logger.warning("Catalog source %s unavailable, using last good copy: %s", source, error)
+        if source in last_good:
+            catalogs.append(last_good[source])
+        else:
+            missing += 1
             
-            if current_category is not None and category != current_category:
-                grouped_products.append({
-                    'type': 'category_separator',
-                    'category': category
-                })
+    if not catalogs or (missing and require_all):
+        raise first_error
+    return merge_catalogs(catalogs)
+
+def save_catalog_snapshot(path: str, catalog: Catalog):
+    """Persist the parsed catalog to a SQLite file, replacing it atomically"""
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+        
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute(
+            "CREATE TABLE products (id INTEGER PRIMARY KEY, category TEXT, name TEXT, "
+            "origin TEXT, price REAL)"
+        )
+        conn.execute("CREATE TABLE separators (position INTEGER)")
+        conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                         [('version', catalog.version), ('saved_at', datetime.now().isoformat())])
+        conn.executemany(
+            "INSERT INTO products VALUES (?, ?, ?, ?, ?)",
+            zip(range(len(catalog)), catalog.category_values(), catalog.names.tolist(),
+                catalog.origin_values(), catalog.prices.tolist())
+        )
+        conn.executemany("INSERT INTO separators VALUES (?)",
+                         ((position,) for position in catalog.separator_positions.tolist()))
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+def load_catalog_snapshot(path: str):
+    """Load a catalog snapshot, returning None when there is no usable file"""
+    if not os.path.exists(path):
+        return None
+        
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            products = conn.execute(
+                "SELECT category, name, origin, price FROM products ORDER BY id"
+            ).fetchall()
+            separators = conn.execute("SELECT position FROM separators ORDER BY position").fetchall()
+        finally:
+            conn.close()
+    except (sqlite3.Error, TypeError) as e:
+        logger.warning("Ignoring unreadable catalog snapshot %s: %s", path, e)
+        return None
+        
+    categories, names, origins, prices = zip(*products) if products else ([], [], [], [])
+    return build_catalog(version, categories, names, origins, prices,
+                         [position for (position,) in separators])
+
+class CatalogCache:
+    """Process-wide stale-while-revalidate cache for the parsed catalog.
+
+    At most one load runs at a time (single flight). The first call blocks on
+    it and concurrent callers wait for the same result. Afterwards, once an
+    entry is older than ``ttl_seconds``, the last good snapshot keeps being
+    served while a background thread fetches a fresh one. Failed loads are
+    not retried before an exponentially growing backoff, or the quota
+    guard's ``retry_after``, has passed.
+    """
+
+    def __init__(self, loader, ttl_seconds: float = CATALOG_TTL_SECONDS):
+        self._loader = loader
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._data = None
+        self._fetched_at = 0.0
+        self._flight = None
+        self._retry_at = 0.0
+        self.failures = 0
+        self.last_error = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self):
+        """Return the cached catalog, refreshing it in the background when stale"""
+        with self._lock:
+            data = self._data
+            now = time.monotonic()
+            stale = now - self._fetched_at >= self.ttl_seconds
+            flight = self._flight
+            leader = flight is None and (data is None or stale) and now >= self._retry_at
+            if data is None:
+                self.misses += 1
+            elif stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            if leader:
+                flight = self._flight = Future()
+            elif data is None and flight is None:
+                # Still backing off after a failed first load
+                raise self.last_error
                 
-            grouped_products.append(item)
-            current_category = category
+        if data is None:
+            # Nothing to serve yet: one caller loads, the others wait for its result
+            if leader:
+                self._load(flight)
+            return flight.result()
             
-        elif item['type'] == 'sub_category_separator':
-            grouped_products.append(item)
+        if leader:
+            threading.Thread(target=self._load, args=(flight,), name="catalog-refresh", daemon=True).start()
+        return data
+
+    def warm(self, seed_loader=None):
+        """Start the first load in the background without waiting for it.
+
+        ``seed_loader`` may return data to serve, as stale, until the real
+        loader has run; callers arriving meanwhile wait for whichever is first.
+        """
+        with self._lock:
+            if self._data is not None or self._flight is not None:
+                return
+            flight = self._flight = Future()
+        threading.Thread(target=self._warm, args=(flight, seed_loader), name="catalog-warmup", daemon=True).start()
+
+    def _warm(self, flight: Future, seed_loader):
+        seed = None
+        if seed_loader is not None:
+            try:
+                seed = seed_loader()
+            except Exception as e:
+                logger.warning("Could not seed the catalog cache: %s", e)
+        if seed is None:
+            self._load(flight)
+            return
             
-    return grouped_products
+        with self._lock:
+            self._data = seed
+            self._fetched_at = -self.ttl_seconds
+            self._flight = None
+        flight.set_result(seed)
+        # The seed is stale, so this starts reconciling it with the sheet
+        self.get()
 
-def update_quantity(product_name: str, change: int):
-    """Update product quantity in cart"""
-    if product_name not in st.session_state.cart:
-        st.session_state.cart[product_name] = {'quantity': 0, 'price': 0.0}
+    def _load(self, flight: Future):
+        try:
+            data = self._loader()
+        except Exception as e:
+            # Keep serving the previous snapshot until the backoff has passed
+            with self._lock:
+                self.failures += 1
+                backoff = min(SHEETS_BACKOFF_BASE_SECONDS * 2 ** self.failures, SHEETS_MAX_BACKOFF_SECONDS)
+                self._retry_at = time.monotonic() + max(backoff, getattr(e, 'retry_after', 0.0))
+                self.last_error = e
+                self._flight = None
+            logger.warning("Catalog load failed: %s", e)
+            flight.set_exception(e)
+            return
+            
+        with self._lock:
+            self._data = data
+            self._fetched_at = time.monotonic()
+            self.failures = 0
+            self.last_error = None
+            self._flight = None
+        flight.set_result(data)
+
+class CatalogHistory:
+    """SKU hashes of the most recent catalog versions, keyed by their cart token tag.
+
+    Lets a cart token saved against an older version be re-keyed to the
+    current product ids.
+    """
+
+    def __init__(self, max_versions: int = CART_TOKEN_CATALOG_VERSIONS):
+        self.max_versions = max_versions
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, catalog: Catalog):
+        tag = catalog_version_tag(catalog.version)
+        sku_hashes = catalog.sku_hashes
+        with self._lock:
+            self._versions[tag] = sku_hashes
+            self._versions.move_to_end(tag)
+            while len(self._versions) > self.max_versions:
+                self._versions.popitem(last=False)
+
+    def sku_hashes(self, tag: bytes):
+        """SKU hashes of the version with this tag, or None when it is not remembered"""
+        with self._lock:
+            return self._versions.get(tag)
+
+@st.cache_resource
+def get_catalog_history() -> CatalogHistory:
+    """Create the catalog version history shared by every session in this process"""
+    return CatalogHistory()
+
+@st.cache_resource
+def get_catalog_cache() -> CatalogCache:
+    """Create the catalog cache shared by every session in this process"""
+    # Read secrets here so the background refresh thread never touches st.*
+    credentials_dict = dict(st.secrets["gcp_service_account"])
+    sources = catalog_sources(st.secrets["google"])
+    guard = get_sheets_guard()
+    metrics = get_metrics()
+    catalog_settings = st.secrets.get("catalog", {})
+    ttl_seconds = float(catalog_settings.get("ttl_seconds", CATALOG_TTL_SECONDS))
+    snapshot_path = catalog_settings.get("snapshot_path", CATALOG_SNAPSHOT_PATH)
+    
+    snapshot_version = {'value': None}
+    last_good_sources = {}
+    pipeline_cache = get_pipeline_cache()
+    history = get_catalog_history()
+    # Whether the served catalog has every source, so a partial fetch must not replace it
+    current = {'catalog': None, 'complete': False}
+    
+    def load_snapshot():
+        snapshot = load_catalog_snapshot(snapshot_path)
+        if snapshot:
+            current['catalog'] = snapshot
+            current['complete'] = True
+            snapshot_version['value'] = snapshot.version
+            history.add(snapshot)
+        return snapshot
+    
+    def fetch_and_snapshot():
+        catalog = fetch_catalog(credentials_dict, sources, guard, metrics, last_good_sources,
+                                require_all=current['complete'])
+        current['complete'] = all(source in last_good_sources for source in sources)
+        # Unchanged sheets keep the current object; price-only changes keep its derived data
+        catalog = derive_catalog(current['catalog'], catalog, pipeline_cache)
+        current['catalog'] = catalog
+        # Build the search index and its ranking lookups here, off the request path
+        catalog.search_index.warm()
+        history.add(catalog)
+        if current['complete'] and catalog.version != snapshot_version['value']:
+            try:
+                save_catalog_snapshot(snapshot_path, catalog)
+                snapshot_version['value'] = catalog.version
+            except (OSError, sqlite3.Error) as e:
+                logger.warning("Could not write catalog snapshot %s: %s", snapshot_path, e)
+        return catalog
+        
+    cache = CatalogCache(fetch_and_snapshot, ttl_seconds)
+    metrics.add_collector(lambda: {
+        'catalog_cache_hits_total': cache.hits,
+        'catalog_cache_stale_hits_total': cache.stale_hits,
+        'catalog_cache_misses_total': cache.misses
+    })
+    # Start from the snapshot, if any, and reconcile with the sheet in the background
+    cache.warm(load_snapshot)
+    return cache
+
+def load_google_sheet():
+    """Load the catalog from Google Sheets through the shared catalog cache"""
+    try:
+        return get_catalog_cache().get()
+    except Exception as e:
+        st.error(f"Error loading Google Sheet: {str(e)}")
+        return None
+
+def filter_products(catalog: Catalog, search_query: str, origin_filter: str, ranked: bool = False) -> np.ndarray:
+    """Return the ids of products matching the search text and origin.
+
+    Ids are in sheet order, or in relevance order when ``ranked`` is set.
+    """
+    origin_selected = origin_filter and origin_filter != "الكل"
+    if ranked and search_query:
+        allowed = catalog.origin_codes == catalog.origin_code(origin_filter) if origin_selected else None
+        return catalog.search_index.rank(search_query, allowed=allowed)
+        
+    if search_query:
+        product_ids = catalog.search_index.search(search_query)
+    else:
+        product_ids = np.arange(len(catalog))
+    if origin_selected:
+        product_ids = product_ids[catalog.origin_codes[product_ids] == catalog.origin_code(origin_filter)]
+    return product_ids
+
+def _bulk_quantity(text: str) -> int:
+    text = text.translate(_DIGIT_TRANSLATION)
+    if text.isdigit() and int(text) <= BULK_ORDER_MAX_QUANTITY:
+        return int(text)
+    return -1
+
+def parse_bulk_order(text: str, index: 'SearchIndex' = None):
+    """Split a pasted or uploaded part list into (line number, product text, quantity) rows.
+
+    A line is a product name or part number with an optional quantity, given
+    either as a tab, semicolon or comma separated column or before or after
+    the name (``3 x ...``, ``... 3``). A missing quantity counts as one. With
+    ``index``, a line that is exactly a product name, such as one ending in a
+    model number, is taken whole. Column headers are dropped; lines with a
+    zero quantity are returned separately as (line number, line) pairs.
+    """
+    rows, skipped = [], []
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        delimiter = next((d for d in _BULK_ORDER_DELIMITERS if d in line), None)
+        if delimiter:
+            fields = [field.strip() for field in next(csv.reader([line], delimiter=delimiter))]
+            if any(normalize_search_text(field) in _BULK_ORDER_HEADERS for field in fields):
+                continue
+            quantities = [(i, _bulk_quantity(field)) for i, field in enumerate(fields) if _bulk_quantity(field) >= 0]
+            # The last numeric column is the quantity, the rest make up the name
+            quantity_column, quantity = quantities[-1] if quantities else (None, 1)
+            name = ' '.join(field for i, field in enumerate(fields) if field and i != quantity_column)
+        else:
+            name, quantity = line, 1
+            if index is None or not index.exact_matches(line):
+                # An explicitly marked leading quantity wins over a number at the end of the name
+                for pattern in (_MARKED_LEADING_QUANTITY, _TRAILING_QUANTITY, _LEADING_QUANTITY):
+                    match = pattern.match(line.translate(_DIGIT_TRANSLATION))
+                    if match and _bulk_quantity(match['quantity']) >= 0:
+                        name, quantity = match['name'].strip(), int(match['quantity'])
+                        break
+        if not name:
+            continue
+        if quantity > 0:
+            rows.append((line_number, name, quantity))
+        else:
+            skipped.append((line_number, line))
+    return rows, skipped
+
+def match_bulk_order(catalog: Catalog, rows: List[tuple]):
+    """Match parsed bulk order rows to products in one batch.
+
+    A row matches the product with exactly its normalized name, or else the
+    best ranked search result scoring at least ``BULK_ORDER_MIN_SCORE``. A
+    trailing origin such as "ياباني" restricts the match to that origin.
+    Returns the matched rows with their product id appended, and the
+    unmatched rows.
+    """
+    index = catalog.search_index
+    origin_codes = {normalize_search_text(label): code for code, label in enumerate(catalog.origin_labels)}
+    matched, unmatched = [], []
+    product_ids = {}
+    for line_number, name, quantity in rows:
+        query = normalize_search_text(name)
+        if query not in product_ids:
+            tokens = query.split()
+            origin_code = origin_codes.get(tokens[-1], -1) if len(tokens) > 1 else -1
+            search = ' '.join(tokens[:-1]) if origin_code >= 0 else query
+            allowed = catalog.origin_codes == origin_code if origin_code >= 0 else None
+            exact = [i for i in index.exact_matches(search) if allowed is None or allowed[i]]
+            if exact:
+                product_ids[query] = exact[0]
+            else:
+                ranked = index.rank(search, limit=1, allowed=allowed, min_score=BULK_ORDER_MIN_SCORE)
+                product_ids[query] = int(ranked[0]) if len(ranked) else None
+        if product_ids[query] is None:
+            unmatched.append((line_number, name, quantity))
+        else:
+            matched.append((line_number, name, quantity, product_ids[query]))
+    return matched, unmatched
+
+def group_products_by_category(catalog: Catalog, product_ids: np.ndarray) -> np.ndarray:
+    """Interleave category and sub-category separator markers with sorted product ids"""
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    if len(product_ids) < 2:
+        return product_ids
         
-    new_quantity = st.session_state.cart[product_name]['quantity'] + change
-    st.session_state.cart[product_name]['quantity'] = max(0, new_quantity)
+    previous, current = product_ids[:-1], product_ids[1:]
+    # A blank sheet row between two shown products becomes one sub-category separator
+    separators_seen = np.searchsorted(catalog.separator_positions, product_ids, side='right')
+    sub_at = np.flatnonzero(separators_seen[1:] > separators_seen[:-1]) + 1
+    cat_at = np.flatnonzero(catalog.category_codes[current] != catalog.category_codes[previous]) + 1
     
-    if st.session_state.cart[product_name]['quantity'] == 0:
-        del st.session_state.cart[product_name]
+    positions = np.concatenate((sub_at, cat_at))
+    markers = np.concatenate((np.full(len(sub_at), SUB_CATEGORY_SEPARATOR),
+                              np.full(len(cat_at), CATEGORY_SEPARATOR)))
+    order = np.argsort(positions, kind='stable')
+    return np.insert(product_ids, positions[order], markers[order])
+
+@dataclass(frozen=True, eq=False)
+class ResultSet:
+    """Products matching one search, with separator markers and page boundaries.
+
+    ``page_starts`` holds the index into ``grouped_products`` where each page
+    begins; every page holds the same number of products plus the
+    separators leading up to them. The facet dicts count the matching
+    products per category and origin, and ``category_pages`` maps each
+    category to the page where it first appears (empty for ranked results).
+    """
+    product_ids: np.ndarray
+    grouped_products: np.ndarray
+    page_starts: np.ndarray
+    category_counts: Dict[str, int]
+    origin_counts: Dict[str, int]
+    category_pages: Dict[str, int]
+
+    @property
+    def product_count(self) -> int:
+        return len(self.product_ids)
+
+    @property
+    def page_count(self) -> int:
+        return max(len(self.page_starts), 1)
+
+    def page(self, page_number: int) -> np.ndarray:
+        """Return the grouped products of a 1-based page"""
+        if not len(self.page_starts):
+            return self.grouped_products[:0]
+        start = self.page_starts[page_number - 1]
+        end = self.page_starts[page_number] if page_number < len(self.page_starts) else len(self.grouped_products)
+        return self.grouped_products[start:end]
+
+def compute_page_starts(grouped_products: np.ndarray, products_per_page: int = PRODUCTS_PER_PAGE) -> np.ndarray:
+    """Index where each page of ``products_per_page`` products begins"""
+    product_positions = np.flatnonzero(grouped_products >= 0)
+    if not len(product_positions):
+        return np.empty(0, dtype=np.int32)
+    # A page starts right after the last product of the previous one
+    ends = product_positions[products_per_page - 1:-1:products_per_page] + 1
+    return np.concatenate(([0], ends)).astype(np.int32)
+
+def count_by_label(codes: np.ndarray, labels: tuple) -> Dict[str, int]:
+    """Count the occurrences of each label among ``codes``, omitting absent ones"""
+    counts = np.bincount(codes, minlength=len(labels))
+    return {labels[code]: count for code, count in enumerate(counts.tolist()) if count}
+
+def first_category_pages(catalog: Catalog, product_ids: np.ndarray,
+                         products_per_page: int = PRODUCTS_PER_PAGE) -> Dict[str, int]:
+    """Map each category to the 1-based page of its first product, in display order"""
+    codes, first_positions = np.unique(catalog.category_codes[product_ids], return_index=True)
+    order = np.argsort(first_positions)
+    pages = first_positions[order] // products_per_page + 1
+    return {catalog.category_labels[code]: page for code, page in zip(codes[order].tolist(), pages.tolist())}
+
+class LRUCache:
+    """Thread-safe least-recently-used cache shared by every session"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for ``key``, computing and storing it on a miss"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            
+        # Computed outside the lock; a concurrent miss on the same key just does the work twice
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def copy_version(self, old_version: str, new_version: str):
+        """Make entries keyed by ``(old_version, ...)`` available under ``new_version`` too"""
+        with self._lock:
+            carried = [((new_version,) + key[1:], value)
+                       for key, value in self._entries.items() if key[0] == old_version]
+            for key, value in carried:
+                self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+@st.cache_resource
+def get_pipeline_cache() -> LRUCache:
+    """Create the result set cache shared by every session in this process"""
+    cache = LRUCache(PIPELINE_CACHE_SIZE)
+    get_metrics().add_collector(lambda: {
+        'pipeline_cache_hits_total': cache.hits,
+        'pipeline_cache_misses_total': cache.misses
+    })
+    return cache
+
+def build_result_set(catalog: Catalog, search_query: str, origin_filter: str, ranked: bool = False,
+                     products_per_page: int = PRODUCTS_PER_PAGE) -> ResultSet:
+    """Filter and group the catalog for one search"""
+    metrics = get_metrics()
+    with metrics.span("filter"):
+        product_ids = filter_products(catalog, search_query, origin_filter, ranked=ranked).astype(np.int32)
+    with metrics.span("group"):
+        if ranked and search_query:
+            # Ranked results keep their relevance order, without separators
+            grouped_products = product_ids
+            category_pages = {}
+        else:
+            grouped_products = group_products_by_category(catalog, product_ids).astype(np.int32)
+            category_pages = first_category_pages(catalog, product_ids, products_per_page)
+    with metrics.span("paginate"):
+        page_starts = compute_page_starts(grouped_products, products_per_page)
+    for array in (product_ids, grouped_products, page_starts):
+        array.setflags(write=False)
+    return ResultSet(
+        product_ids=product_ids,
+        grouped_products=grouped_products,
+        page_starts=page_starts,
+        category_counts=count_by_label(catalog.category_codes[product_ids], catalog.category_labels),
+        origin_counts=count_by_label(catalog.origin_codes[product_ids], catalog.origin_labels),
+        category_pages=category_pages
+    )
+
+def get_result_set(catalog: Catalog, search_query: str, origin_filter: str, ranked: bool = False,
+                   products_per_page: int = PRODUCTS_PER_PAGE) -> ResultSet:
+    """Return the cached result set for (catalog version, normalized query, origin, mode, page size)"""
+    normalized_query = normalize_search_text(search_query)
+    ranked = ranked and bool(normalized_query)
+    key = (catalog.version, normalized_query, origin_filter, ranked, products_per_page)
+    return get_pipeline_cache().get_or_compute(
+        key, lambda: build_result_set(catalog, normalized_query, origin_filter, ranked, products_per_page)
+    )
+
+def minor_units(amount: float) -> int:
+    """Whole piastres in a price in pounds"""
+    return round(amount * 100)
+
+class CartEntry:
+    """One ordered product; its SKU hash identifies it across catalog versions"""
+    __slots__ = ('product_id', 'sku', 'price', 'quantity')
+
+    def __init__(self, product_id: int, sku: int, price: float, quantity: int = 0):
+        self.product_id = product_id
+        self.sku = sku
+        self.price = price
+        self.quantity = quantity
+
+    @property
+    def subtotal(self) -> float:
+        return self.quantity * minor_units(self.price) / 100
+
+class Cart:
+    """Order cart keyed by product id with running item and cost totals.
+
+    The cost is kept in whole piastres so adding and removing products never
+    leaves float residue. ``version`` increases on every change so derived
+    values can be cached against it.
+    """
+    __slots__ = ('entries', 'total_items', 'total_cents', 'catalog_version', 'version', 'created_at', 'order_id')
+
+    def __init__(self):
+        self.order_id = uuid.uuid4().hex[:10]
+        self.created_at = datetime.now()
+        self.entries: Dict[int, CartEntry] = {}
+        self.total_items = 0
+        self.total_cents = 0
+        self.catalog_version = None
+        self.version = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    @property
+    def total_cost(self) -> float:
+        return self.total_cents / 100
+
+    def quantity(self, product_id: int) -> int:
+        entry = self.entries.get(product_id)
+        return entry.quantity if entry else 0
+
+    def update(self, catalog: Catalog, product_id: int, change: int):
+        """Change a product's quantity, keeping the totals current"""
+        entry = self.entries.get(product_id)
+        if entry is None:
+            if change <= 0:
+                return
+            entry = CartEntry(product_id, int(catalog.sku_hashes[product_id]), float(catalog.prices[product_id]))
+            self.entries[product_id] = entry
+            self.catalog_version = catalog.version
+            
+        new_quantity = max(0, entry.quantity + change)
+        delta = new_quantity - entry.quantity
+        entry.quantity = new_quantity
+        self.total_items += delta
+        self.total_cents += delta * minor_units(entry.price)
+        if entry.quantity == 0:
+            del self.entries[product_id]
+        self.version += 1
+
+    def reprice(self, catalog: Catalog) -> int:
+        """Re-key and re-price every entry against ``catalog`` in one pass.
+
+        Returns how many products no longer exist and were dropped.
+        """
+        if catalog.version == self.catalog_version:
+            return 0
+            
+        diff = catalog.diff
+        id_map = None
+        if diff is not None and diff.old_version == self.catalog_version:
+            if diff.layout_unchanged:
+                self._apply_price_changes(catalog, diff.price_changed)
+                return 0
+            # One version behind: the diff maps old ids to new ones without the SKU lookup
+            id_map = diff.id_map
+            
+        entries = {}
+        removed = 0
+        total_items, total_cents = 0, 0
+        for entry in self.entries.values():
+            if id_map is not None:
+                product_id = int(id_map[entry.product_id])
+                product_id = product_id if product_id >= 0 else None
+            else:
+                product_id = catalog.sku_ids.get(entry.sku)
+            if product_id is None:
+                removed += 1
+                continue
+            entry.price = float(catalog.prices[product_id])
+            total_items += entry.quantity
+            total_cents += entry.quantity * minor_units(entry.price)
+            # Duplicate sheet rows share a SKU and collapse onto its first id
+            if product_id in entries:
+                entries[product_id].quantity += entry.quantity
+                continue
+            entry.product_id = product_id
+            entries[product_id] = entry
+            
+        self.entries = entries
+        self.total_items, self.total_cents = total_items, total_cents
+        self.catalog_version = catalog.version
+        self.version += 1
+        return removed
+
+    def _apply_price_changes(self, catalog: Catalog, changed_ids: np.ndarray):
+        # Ids are unchanged, so only entries whose price moved need touching
+        if len(changed_ids) < len(self.entries):
+            affected = [self.entries[i] for i in changed_ids.tolist() if i in self.entries]
+        else:
+            changed = set(changed_ids.tolist())
+            affected = [entry for entry in self.entries.values() if entry.product_id in changed]
+            
+        for entry in affected:
+            new_price = float(catalog.prices[entry.product_id])
+            self.total_cents += entry.quantity * (minor_units(new_price) - minor_units(entry.price))
+            entry.price = new_price
+        self.catalog_version = catalog.version
+        if affected:
+            self.version += 1
+
+    def add_lines(self, catalog: Catalog, lines) -> int:
+        """Add (product id, quantity) pairs priced from ``catalog`` in one pass.
+
+        Returns how many lines name no current product and were skipped.
+        """
+        skipped = 0
+        for product_id, quantity in lines:
+            if product_id is None or not 0 <= product_id < len(catalog) or quantity <= 0:
+                skipped += 1
+                continue
+            entry = self.entries.get(product_id)
+            if entry is None:
+                entry = CartEntry(product_id, int(catalog.sku_hashes[product_id]), float(catalog.prices[product_id]))
+                self.entries[product_id] = entry
+            entry.quantity += quantity
+            self.total_items += quantity
+            self.total_cents += quantity * minor_units(entry.price)
+        self.catalog_version = catalog.version
+        self.version += 1
+        return skipped
+
+def catalog_version_tag(version: str) -> bytes:
+    """Short tag identifying a catalog version inside cart tokens"""
+    return hashlib.sha1(version.encode()).digest()[:CART_TOKEN_TAG_BYTES]
+
+def _append_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(data: bytes, position: int):
+    value = shift = 0
+    while True:
+        if position >= len(data):
+            raise ValueError("Truncated cart token")
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+def encode_cart_token(cart: Cart) -> str:
+    """Pack the cart into a short URL-safe token.
+
+    After the format byte and catalog version tag come the line count and,
+    in product id order, each id's gap from the previous one and its
+    quantity, all as varints. The order id is left out: a link can be opened
+    in several sessions, and each must log its own order.
+    """
+    out = bytearray([CART_TOKEN_FORMAT])
+    out += catalog_version_tag(cart.catalog_version or "")
+    _append_varint(out, len(cart.entries))
+    previous = -1
+    for product_id in sorted(cart.entries):
+        _append_varint(out, product_id - previous - 1)
+        _append_varint(out, cart.entries[product_id].quantity)
+        previous = product_id
+    return base64.urlsafe_b64encode(bytes(out)).rstrip(b"=").decode("ascii")
+
+def decode_cart_token(token: str):
+    """Unpack a cart token into its version tag, product ids and quantities.
+
+    Raises ValueError when the token is malformed.
+    """
+    data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    header_length = 1 + CART_TOKEN_TAG_BYTES
+    if len(data) < header_length or data[0] != CART_TOKEN_FORMAT:
+        raise ValueError("Unsupported cart token")
+    tag = data[1:header_length]
+    count, position = _read_varint(data, header_length)
+    product_ids, quantities = [], []
+    product_id = -1
+    for _ in range(count):
+        gap, position = _read_varint(data, position)
+        quantity, position = _read_varint(data, position)
+        product_id += gap + 1
+        product_ids.append(product_id)
+        quantities.append(quantity)
+    if position != len(data):
+        raise ValueError("Trailing data in cart token")
+    return tag, product_ids, quantities
+
+def restore_cart(token: str, catalog: Catalog, history: CatalogHistory):
+    """Rebuild a cart saved with ``encode_cart_token``, priced from ``catalog``.
+
+    The cart gets a new order id. Ids saved against an older catalog version
+    are re-keyed by SKU. Returns the cart and how many lines were dropped, or
+    None when the saved version is no longer known. Raises ValueError when
+    the token is malformed.
+    """
+    tag, product_ids, quantities = decode_cart_token(token)
+    if tag != catalog_version_tag(catalog.version):
+        old_sku_hashes = history.sku_hashes(tag)
+        if old_sku_hashes is None:
+            return None
+        product_ids = [catalog.sku_ids.get(int(old_sku_hashes[i])) if i < len(old_sku_hashes) else None
+                       for i in product_ids]
+    cart = Cart()
+    dropped = cart.add_lines(catalog, zip(product_ids, quantities))
+    return cart, dropped
+
+def save_cart_to_url(cart: Cart):
+    """Keep the cart token in the page URL current; this does not trigger a rerun"""
+    token = encode_cart_token(cart) if cart.entries else None
+    if st.query_params.get(CART_QUERY_PARAM) != token:
+        if token:
+            st.query_params[CART_QUERY_PARAM] = token
+        else:
+            st.query_params.pop(CART_QUERY_PARAM, None)
+
+def update_quantity(catalog: Catalog, product_id: int, change: int):
+    """Update product quantity in cart"""
+    st.session_state.cart.update(catalog, product_id, change)
+    save_cart_to_url(st.session_state.cart)
 
 def get_cart_summary():
     """Get cart summary statistics"""
-    total_items = sum(item['quantity'] for item in st.session_state.cart.values())
-    total_cost = sum(item['quantity'] * item['price'] for item in st.session_state.cart.values())
-    return total_items, total_cost
+    cart = st.session_state.cart
+    return cart.total_items, cart.total_cost
 
-def generate_whatsapp_message():
-    """Generate WhatsApp message with proper Arabic formatting"""
-    if not st.session_state.cart:
-        return ""
+def format_amount(value: float) -> str:
+    """Format a price or total without a trailing .0"""
+    return f"{value:.2f}".rstrip('0').rstrip('.')
+
+def encode_order_line(name: str, origin: str, quantity: int, price: float) -> str:
+    """URL-encode the compact message line of one ordered product"""
+    line = f"🔹 {name} ({origin}) | {quantity} × {format_amount(price)} = *{format_amount(quantity * price)}* ج.م"
+    return urllib.parse.quote(line)
+
+@st.cache_resource
+def get_order_line_cache() -> LRUCache:
+    """Create the encoded order line cache shared by every session in this process"""
+    cache = LRUCache(ORDER_LINE_CACHE_SIZE)
+    get_metrics().add_collector(lambda: {
+        'order_line_cache_hits_total': cache.hits,
+        'order_line_cache_misses_total': cache.misses
+    })
+    return cache
+
+def build_whatsapp_messages(cart: Cart, catalog: Catalog, max_encoded_length: int = WHATSAPP_MAX_ENCODED_LENGTH,
+                            line_cache: LRUCache = None) -> List[str]:
+    """Build URL-encoded order messages, split so none exceeds ``max_encoded_length``.
+
+    Lines are looked up in ``line_cache``, if given, by (name, origin, quantity, price).
+    """
+    newline = urllib.parse.quote("\n")
+    order_date = cart.created_at.strftime("%Y-%m-%d %H:%M:%S")
+    
+    def header(part: int, parts: int) -> str:
+        title = "📋 *تفاصيل الطلبية:*" if parts == 1 else f"📋 *تفاصيل الطلبية ({part}/{parts}):*"
+        return urllib.parse.quote("\n".join([
+            "🌟 *شركة المهندس لقطع غيار السيارات* 🌟",
+            f"📅 *تاريخ الطلب:* {order_date}",
+            f"🧾 *رقم الطلبية:* {cart.order_id}",
+            title,
+            ""
+        ]))
         
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    message_lines = [
-        "🌟 *شركة المهندس لقطع غيار السيارات* 🌟",
-        "",
-        f"📅 *تاريخ الطلب:* {now}",
+    summary = urllib.parse.quote("\n".join([
         "",
-        "📋 *تفاصيل الطلبية:*",
-        ""
-    ]
-    
-    for product_name, details in st.session_state.cart.items():
-        qty = details['quantity']
-        price = details['price']
-        subtotal = qty * price
-        message_lines.append(f"🔹 *{product_name}*")
-        message_lines.append(f"   - الكمية: {qty}")
-        message_lines.append(f"   - السعر: {price} ج.م")
-        message_lines.append(f"   - الإجمالي: *{subtotal} ج.م*")
-        message_lines.append("")
-        
-    total_items, total_cost = get_cart_summary()
-    message_lines.extend([
         "📊 *ملخص الطلبية:*",
-        f"   - عدد الأصناف: {total_items}",
-        f"   - الإجمالي النهائي: *{total_cost} ج.م*",
+        f"   - عدد الأصناف: {cart.total_items}",
+        f"   - الإجمالي النهائي: *{format_amount(cart.total_cost)} ج.م*",
         "",
         "شكراً لثقتكم بنا!",
         "سيتم التواصل معكم قريباً لتأكيد الطلبية."
-    ])
+    ]))
+    continued = urllib.parse.quote("\n⏬ يتبع في الرسالة التالية")
+    
+    # Pack lines greedily, leaving room for the widest header and the summary
+    budget = max_encoded_length - len(header(99, 99)) - max(len(summary), len(continued))
+    parts = [[]]
+    size = 0
+    for entry in cart:
+        key = (catalog.names[entry.product_id], catalog.origin(entry.product_id), entry.quantity, entry.price)
+        if line_cache is None:
+            line = encode_order_line(*key)
+        else:
+            line = line_cache.get_or_compute(key, lambda: encode_order_line(*key))
+        if parts[-1] and size + len(line) + len(newline) > budget:
+            parts.append([])
+            size = 0
+        parts[-1].append(line)
+        size += len(line) + len(newline)
+        
+    messages = []
+    for part, lines in enumerate(parts, start=1):
+        footer = summary if part == len(parts) else continued
+        messages.append(header(part, len(parts)) + newline.join(lines) + footer)
+    return messages
+
+def generate_whatsapp_messages(catalog: Catalog) -> List[str]:
+    """Return the encoded WhatsApp messages for the cart, rebuilt only when it changes"""
+    cart = st.session_state.cart
+    if not cart:
+        return []
+        
+    cache_key = (cart.order_id, cart.version)
+    cached = st.session_state.get('whatsapp_messages')
+    if cached and cached[0] == cache_key:
+        return cached[1]
+        
+    with get_metrics().span("message"):
+        messages = build_whatsapp_messages(cart, catalog, line_cache=get_order_line_cache())
+    st.session_state.whatsapp_messages = (cache_key, messages)
+    return messages
+
+def send_order(catalog: Catalog):
+    """Log the cart as a sent order; its WhatsApp links are shown until it changes"""
+    cart = st.session_state.cart
+    sent = (cart.order_id, cart.version)
+    if not cart or st.session_state.get('order_sent') == sent:
+        return
+    try:
+        get_order_log().record(cart, catalog)
+    except sqlite3.Error as e:
+        logger.warning("Could not record order %s: %s", cart.order_id, e)
+    st.session_state.order_sent = sent
+
+class OrderLog:
+    """Durable local log of sent orders in a WAL-mode SQLite file.
+
+    Every order is kept under its id with the latest cart contents; a revision
+    counter tells the sheet sync which orders still need to be written back.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS orders (order_id TEXT PRIMARY KEY, revision INTEGER, "
+                "created_at TEXT, updated_at REAL, total_items INTEGER, total_cost REAL, "
+                "lines TEXT, synced_revision INTEGER DEFAULT 0)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, cart: Cart, catalog: Catalog):
+        """Insert or update the cart's order"""
+        lines = json.dumps([[catalog.names[entry.product_id], catalog.origin(entry.product_id),
+                             entry.quantity, entry.price] for entry in cart],
+                           ensure_ascii=False)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO orders (order_id, revision, created_at, updated_at, total_items, total_cost, lines) "
+                "VALUES (?, 1, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(order_id) DO UPDATE SET revision = revision + 1, updated_at = excluded.updated_at, "
+                "total_items = excluded.total_items, total_cost = excluded.total_cost, lines = excluded.lines",
+                (cart.order_id, cart.created_at.isoformat(timespec='seconds'), time.time(),
+                 cart.total_items, cart.total_cost, lines)
+            )
+
+    def pending(self, settled_before: float, limit: int = ORDER_SYNC_BATCH_SIZE) -> List[tuple]:
+        """Orders changed since their last sync and untouched since ``settled_before``"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT order_id, revision, created_at, total_items, total_cost, lines FROM orders "
+                "WHERE synced_revision < revision AND updated_at <= ? ORDER BY updated_at LIMIT ?",
+                (settled_before, limit)
+            ).fetchall()
+
+    def mark_synced(self, synced: List[tuple]):
+        """Record (order_id, revision) pairs as written to the sheet"""
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE orders SET synced_revision = ? WHERE order_id = ? AND synced_revision < ?",
+                [(revision, order_id, revision) for order_id, revision in synced]
+            )
+
+def order_sheet_row(order: tuple) -> List:
+    """Convert a pending order into a row of the orders worksheet"""
+    order_id, revision, created_at, total_items, total_cost, lines = order
+    details = "\n".join(f"{name} ({origin}) × {quantity} @ {format_amount(price)}"
+                        for name, origin, quantity, price in json.loads(lines))
+    return [order_id, revision, created_at, total_items, total_cost, details]
+
+class OrderSheetSync:
+    """Background worker appending settled orders to the orders worksheet in batches.
+
+    ``open_worksheet`` is called lazily from the worker thread and must return an
+    object with gspread's ``append_rows``; appends go through the shared quota
+    guard, failures back off exponentially and the orders stay pending in the
+    local log.
+    """
+
+    def __init__(self, order_log: OrderLog, open_worksheet, guard: SheetsQuotaGuard,
+                 interval_seconds: float = ORDER_SYNC_INTERVAL_SECONDS,
+                 settle_seconds: float = ORDER_SETTLE_SECONDS):
+        self.order_log = order_log
+        self._open_worksheet = open_worksheet
+        self._worksheet = None
+        self.guard = guard
+        self.interval_seconds = interval_seconds
+        self.settle_seconds = settle_seconds
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="order-sheet-sync", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        delay = self.interval_seconds
+        while not self._stop.wait(delay):
+            try:
+                self.sync_once()
+                self.failures = 0
+                delay = self.interval_seconds
+            except Exception as e:
+                self.failures += 1
+                delay = min(self.interval_seconds * 2 ** self.failures, ORDER_SYNC_MAX_BACKOFF_SECONDS)
+                delay = max(delay, getattr(e, 'retry_after', 0.0))
+                if _is_quota_error(e):
+                    logger.info("Orders sheet quota exceeded, retrying in %.0fs", delay)
+                else:
+                    self._worksheet = None
+                    logger.warning("Order sync failed, retrying in %.0fs: %s", delay, e)
+
+    def sync_once(self) -> int:
+        """Append one batch of settled orders, returning how many were written"""
+        orders = self.order_log.pending(time.time() - self.settle_seconds)
+        if not orders:
+            return 0
+        if self._worksheet is None:
+            self._worksheet = self._open_worksheet()
+        self.guard.call(self._worksheet.append_rows, [order_sheet_row(order) for order in orders],
+                        value_input_option='RAW')
+        self.order_log.mark_synced([(order[0], order[1]) for order in orders])
+        return len(orders)
+
+def open_orders_worksheet(credentials_dict: Dict, sheet_id: str, title: str, guard: SheetsQuotaGuard):
+    """Open the orders worksheet with write access, creating it on first use"""
+    import gspread
+    from google.oauth2.service_account import Credentials
     
-    message = "\n".join(message_lines)
-    return urllib.parse.quote(message)
+    scopes = ['https://www.googleapis.com/auth/spreadsheets']
+    credentials = Credentials.from_service_account_info(credentials_dict, scopes=scopes)
+    spreadsheet = guard.call(gspread.authorize(credentials).open_by_key, sheet_id)
+    try:
+        return guard.call(spreadsheet.worksheet, title)
+    except gspread.exceptions.WorksheetNotFound:
+        worksheet = guard.call(spreadsheet.add_worksheet, title, rows=1, cols=len(ORDERS_WORKSHEET_HEADERS))
+        guard.call(worksheet.append_row, ORDERS_WORKSHEET_HEADERS)
+        return worksheet
+
+@st.cache_resource
+def get_order_log() -> OrderLog:
+    """Open the order log and, when configured, start syncing it to the sheet"""
+    order_settings = st.secrets.get("orders", {})
+    order_log = OrderLog(order_settings.get("log_path", ORDER_LOG_PATH))
+    if order_settings.get("sync_to_sheet", False):
+        credentials_dict = dict(st.secrets["gcp_service_account"])
+        sheet_id = order_settings.get("sheet_id", st.secrets["google"]["sheet_id"])
+        title = order_settings.get("worksheet", "Orders")
+        guard = get_sheets_guard()
+        OrderSheetSync(
+            order_log,
+            lambda: open_orders_worksheet(credentials_dict, sheet_id, title, guard),
+            guard,
+            settle_seconds=float(order_settings.get("settle_seconds", ORDER_SETTLE_SECONDS))
+        ).start()
+    return order_log
 
-def display_products_table(grouped_products):
+def display_products_table(catalog: Catalog, grouped_products: np.ndarray, summary_slot):
     """Display products in a responsive format optimized for mobile"""
-    if not grouped_products:
+    if not len(grouped_products):
         st.warning("لا توجد منتجات للعرض")
         return
         
-    for i, item in enumerate(grouped_products):
-        if item['type'] == 'category_separator':
-            st.markdown('<div class="category-separator"></div>', unsafe_allow_html=True)
-        elif item['type'] == 'sub_category_separator':
-            st.markdown('<div class="sub-category-separator"></div>', unsafe_allow_html=True)
-        elif item['type'] == 'product':
-            product = item['data']
-            unique_key_base = item['global_id']
-            product_name = product['البند']
-            origin = product['المنشأ']
-            price = product['السعر']
-            
-            current_qty = st.session_state.cart.get(product_name, {}).get('quantity', 0)
-            subtotal = current_qty * price if current_qty > 0 else 0
-            
-            # Update cart with current price
-            if product_name in st.session_state.cart:
-                st.session_state.cart[product_name]['price'] = price
-                
-            # Product card container
-            st.markdown('<div class="product-card">', unsafe_allow_html=True)
-            
-            # Product header with name and origin
-            st.markdown('<div class="product-header">', unsafe_allow_html=True)
-            st.markdown(f'<div class="product-name">{product_name}</div>', unsafe_allow_html=True)
-            st.markdown(f'<div class="product-origin">{origin}</div>', unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Price section
-            st.markdown('<div class="price-section">', unsafe_allow_html=True)
-            col1, col2 = st.columns(2)
-            with col1:
-                st.markdown("السعر")
-                st.markdown(f"<strong>{price} ج.م</strong>")
-            with col2:
-                st.markdown("الإجمالي الجزئي")
-                st.markdown(f"<strong>{subtotal} ج.م</strong>")
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Quantity controls
-            st.markdown('<div class="quantity-controls">', unsafe_allow_html=True)
-            col1, col2, col3 = st.columns([1, 1, 1])
-            
-            with col1:
-                if st.button("➖", key=f"minus_{unique_key_base}", help="تقليل الكمية", use_container_width=True):
-                    update_quantity(product_name, -1)
-                    st.rerun()
-                    
-            with col2:
-                st.markdown(f'<div class="qty-display">{current_qty}</div>', unsafe_allow_html=True)
-                
-            with col3:
-                if st.button("➕", key=f"plus_{unique_key_base}", help="زيادة الكمية", use_container_width=True):
-                    if product_name not in st.session_state.cart:
-                        st.session_state.cart[product_name] = {'quantity': 0, 'price': price}
-                    update_quantity(product_name, 1)
-                    st.rerun()
-                    
-            st.markdown('</div>', unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-
-def display_order_details():
+    # Separators are folded into the HTML of the card that follows them
+    separators = []
+    for item in grouped_products.tolist():
+        if item < 0:
+            separators.append(SEPARATOR_HTML[item])
+        else:
+            display_product_card(catalog, item, summary_slot, ''.join(separators))
+            separators = []
+
+def render_product_card_html(name: str, origin: str, price: float, quantity: int, separators: str = '') -> str:
+    """Fill the product card template, escaping sheet values"""
+    subtotal = quantity * minor_units(price) / 100 if quantity > 0 else 0
+    return PRODUCT_CARD_TEMPLATE.format(
+        separators=separators,
+        name=html.escape(name),
+        origin=html.escape(origin),
+        price=format_amount(price),
+        subtotal=format_amount(subtotal),
+        quantity=quantity
+    )
+
+@st.fragment
+@timed_fragment
+def display_product_card(catalog: Catalog, product_id: int, summary_slot, separators: str = ''):
+    """Display one product card as a single HTML block followed by its quantity buttons.
+
+    The buttons only rerun this card and the cart summary.
+    """
+    unique_key_base = product_id
+    product_name = catalog.names[product_id]
+    origin = catalog.origin(product_id)
+    price = float(catalog.prices[product_id])
+    
+    # Reserve the card's place; it is drawn once the buttons have been handled
+    card_slot = st.empty()
+    col1, col2 = st.columns(2)
+    with col1:
+        decrease = st.button("➖", key=f"minus_{unique_key_base}", help="تقليل الكمية", use_container_width=True)
+    with col2:
+        increase = st.button("➕", key=f"plus_{unique_key_base}", help="زيادة الكمية", use_container_width=True)
+        
+    if decrease or increase:
+        was_empty = not st.session_state.cart
+        update_quantity(catalog, product_id, 1 if increase else -1)
+        if was_empty != (not st.session_state.cart):
+            # The send button is drawn outside the fragment, so a full rerun shows or hides it
+            st.rerun()
+        display_cart_summary(catalog, summary_slot)
+        
+    current_qty = st.session_state.cart.quantity(product_id)
+    card_slot.markdown(
+        render_product_card_html(product_name, origin, price, current_qty, separators),
+        unsafe_allow_html=True
+    )
+
+def display_order_details(catalog: Catalog):
     """Display order details in a responsive format"""
     if not st.session_state.cart:
         return
         
     st.markdown("### 📋 تفاصيل الطلبية")
     
-    for product_name, details in st.session_state.cart.items():
-        qty = details['quantity']
-        price = details['price']
-        subtotal = qty * price
+    for entry in st.session_state.cart:
+        product_name = html.escape(catalog.names[entry.product_id])
+        qty = entry.quantity
+        price = format_amount(entry.price)
+        subtotal = format_amount(entry.subtotal)
         
         st.markdown(f'''
         <div class="product-card">
@@ -482,12 +2370,222 @@ def display_order_details():
         </div>
         ''', unsafe_allow_html=True)
 
+def display_cart_summary(catalog: Catalog, summary_slot):
+    """Render the order summary, details and, once sent, the WhatsApp links into ``summary_slot``"""
+    if not st.session_state.cart:
+        summary_slot.empty()
+        return
+        
+    with summary_slot.container():
+        st.markdown("---")
+        total_items, total_cost = get_cart_summary()
+        
+        # Summary cards
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown(f"""
+            <div class="summary-card">
+                <div class="summary-title">📦 عدد الأصناف</div>
+                <div class="stat-number">{total_items}</div>
+            </div>
+            """, unsafe_allow_html=True)
+        with col2:
+            st.markdown(f"""
+            <div class="summary-card">
+                <div class="summary-title">💰 الإجمالي</div>
+                <div class="stat-number">{format_amount(total_cost)}</div>
+                <div class="stat-label">جنيه مصري</div>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        # Order details
+        display_order_details(catalog)
+        
+        # WhatsApp links, once this version of the cart has been sent
+        cart = st.session_state.cart
+        if st.session_state.get('order_sent') != (cart.order_id, cart.version):
+            return
+        st.markdown("---")
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col2:
+            whatsapp_number = st.secrets["whatsapp"]["number"]
+            whatsapp_messages = generate_whatsapp_messages(catalog)
+            st.success("تم تسجيل الطلبية، افتح واتساب لإرسالها")
+            links = []
+            for part, whatsapp_message in enumerate(whatsapp_messages, start=1):
+                whatsapp_url = f"https://wa.me/{whatsapp_number}?text={whatsapp_message}"
+                label = "📱 فتح واتساب"
+                if len(whatsapp_messages) > 1:
+                    label += f" ({part}/{len(whatsapp_messages)})"
+                links.append(f'<a href="{whatsapp_url}" target="_blank" class="whatsapp-btn">{label}</a>')
+            if len(links) > 1:
+                st.info("الطلبية كبيرة، يرجى إرسال جميع الرسائل بالترتيب")
+            st.markdown('<br>'.join(links), unsafe_allow_html=True)
+
+def display_send_button(catalog: Catalog):
+    """Show the send button below the summary; it is drawn on full reruns only"""
+    if not st.session_state.cart:
+        return
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        st.button("📱 إرسال الطلبية عبر واتساب", on_click=send_order, args=(catalog,),
+                  use_container_width=True, type="primary")
+
 def navigate_to_page(new_page):
     """Navigate to a new page"""
     st.session_state.current_page = new_page
     st.rerun()
 
-def main():
+def jump_to_category(category_pages: Dict[str, int]):
+    """Go to the page where the chosen category starts and clear the choice"""
+    category = st.session_state.category_jump
+    if category in category_pages:
+        st.session_state.current_page = category_pages[category]
+        st.session_state.list_pages = (category_pages[category], category_pages[category])
+    st.session_state.category_jump = None
+
+def show_more_products(page_count: int):
+    """Extend the continuous list by one page, dropping the oldest beyond the limit"""
+    first, last = st.session_state.list_pages
+    last = min(last + 1, page_count)
+    st.session_state.list_pages = (max(first, last - LIST_MAX_RENDERED_PAGES + 1), last)
+
+def show_earlier_products():
+    """Bring back the page before the first one shown in the continuous list"""
+    first, last = st.session_state.list_pages
+    first = max(first - 1, 1)
+    st.session_state.list_pages = (first, min(last, first + LIST_MAX_RENDERED_PAGES - 1))
+
+@st.fragment
+@timed_fragment
+def display_product_list(catalog: Catalog, result_set: ResultSet, summary_slot):
+    """Display a continuously growing window of pages.
+
+    Showing more or earlier products only reruns this fragment, and only the
+    pages in the window are rendered.
+    """
+    first, last = st.session_state.list_pages
+    if first > 1:
+        st.button("⬆️ المنتجات السابقة", on_click=show_earlier_products, use_container_width=True)
+    # The window's bounds come from the result set's precomputed page starts, so it is a plain slice
+    start = result_set.page_starts[first - 1]
+    end = result_set.page_starts[last] if last < len(result_set.page_starts) else len(result_set.grouped_products)
+    with get_metrics().span("render"):
+        display_products_table(catalog, result_set.grouped_products[start:end], summary_slot)
+    if last < result_set.page_count:
+        st.button("⬇️ عرض المزيد", on_click=show_more_products, args=(result_set.page_count,),
+                  use_container_width=True, type="primary")
+
+def read_bulk_order_file(uploaded_file) -> str:
+    """Decode an uploaded part list; Excel often saves CSV as Windows Arabic rather than UTF-8"""
+    data = uploaded_file.getvalue()
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return data.decode('cp1256', errors='replace')
+
+def apply_bulk_order(catalog: Catalog):
+    """Add every matched bulk order line to the cart in a single update"""
+    _, matched, _, _ = st.session_state.bulk_order
+    cart = st.session_state.cart
+    cart.reprice(catalog)
+    cart.add_lines(catalog, [(product_id, quantity) for _, _, quantity, product_id in matched])
+    save_cart_to_url(cart)
+    st.session_state.bulk_order = None
+
+def display_bulk_order(catalog: Catalog):
+    """Match a pasted or uploaded part list against the catalog and offer to add it to the cart"""
+    with st.expander("📋 طلب قائمة كاملة (لصق أو رفع ملف)"):
+        with st.form("bulk_order_form"):
+            pasted = st.text_area("الصق قائمة القطع، كل صنف في سطر مع الكمية",
+                                  placeholder="فلتر زيت كورولا 2\nتيل فرامل النترا أمامي، 1")
+            uploaded = st.file_uploader("أو ارفع ملف CSV", type=["csv", "txt"])
+            submitted = st.form_submit_button("🔎 مطابقة مع المنتجات", use_container_width=True)
+            
+        if submitted:
+            text = pasted + "\n" + (read_bulk_order_file(uploaded) if uploaded else "")
+            rows, skipped = parse_bulk_order(text, catalog.search_index)
+            if len(rows) > BULK_ORDER_MAX_LINES:
+                st.warning(f"تمت مطابقة أول {BULK_ORDER_MAX_LINES} سطر فقط")
+                rows = rows[:BULK_ORDER_MAX_LINES]
+            st.session_state.bulk_order = (None, [], rows, skipped)
+            
+        if not st.session_state.bulk_order:
+            return
+        version, matched, unmatched, skipped = st.session_state.bulk_order
+        if version != catalog.version:
+            # New lists, and lists matched against an older catalog version, are matched in one batch
+            rows = sorted([row[:3] for row in matched] + unmatched)
+            with get_metrics().span("bulk_match"):
+                matched, unmatched = match_bulk_order(catalog, rows)
+            st.session_state.bulk_order = (catalog.version, matched, unmatched, skipped)
+            
+        if matched:
+            st.dataframe([
+                {"السطر": line_number, "المطلوب": name, "المنتج": catalog.names[product_id],
+                 "المنشأ": catalog.origin(product_id), "الكمية": quantity,
+                 "السعر": format_amount(float(catalog.prices[product_id]))}
+                for line_number, name, quantity, product_id in matched
+            ], hide_index=True, use_container_width=True)
+        if unmatched:
+            st.warning(f"لم يتم العثور على {len(unmatched)} صنف، يرجى البحث عنها يدوياً:\n\n"
+                       + "\n".join(f"- سطر {line_number}: {name}" for line_number, name, _ in unmatched))
+        if skipped:
+            st.info(f"تم تخطي {len(skipped)} سطر كميته صفر:\n\n"
+                    + "\n".join(f"- سطر {line_number}: {line}" for line_number, line in skipped))
+        if matched:
+            st.button(f"➕ إضافة {len(matched)} صنف إلى الطلبية", on_click=apply_bulk_order, args=(catalog,),
+                      use_container_width=True, type="primary")
+
+def restore_saved_cart(catalog: Catalog):
+    """Resume the order saved in the page URL, in the same rerun"""
+    token = st.session_state.cart_token
+    st.session_state.cart_token = None
+    with get_metrics().span("cart_restore"):
+        try:
+            restored = restore_cart(token, catalog, get_catalog_history())
+        except ValueError:
+            restored = None
+    if restored is None:
+        st.warning("تعذر استعادة الطلبية المحفوظة في الرابط، يرجى إضافة المنتجات من جديد")
+        return
+    cart, dropped = restored
+    st.session_state.cart = cart
+    if dropped:
+        st.warning(f"تمت إزالة {dropped} منتج لم يعد متوفراً من الطلبية")
+
+# Initialize session state
+if 'cart' not in st.session_state:
+    st.session_state.cart = Cart()
+    # A cart saved in the URL is restored once the catalog is loaded
+    st.session_state.cart_token = st.query_params.get(CART_QUERY_PARAM)
+    if st.session_state.cart_token:
+        st.session_state.show_order_form = True
+if 'current_page' not in st.session_state:
+    st.session_state.current_page = 1
+if 'show_order_form' not in st.session_state:
+    st.session_state.show_order_form = False
+if 'search_query' not in st.session_state:
+    st.session_state.search_query = ""
+if 'origin_filter' not in st.session_state:
+    st.session_state.origin_filter = "الكل"
+if 'list_pages' not in st.session_state:
+    # First and last page shown in the continuous list, and the search they belong to
+    st.session_state.list_pages = (1, 1)
+    st.session_state.list_search = None
+if 'bulk_order' not in st.session_state:
+    # Catalog version, matched, unmatched and zero-quantity lines of a pasted or uploaded part list
+    st.session_state.bulk_order = None
+
+def render_order_page():
+    # Start warming the shared catalog in the background; this returns immediately
+    try:
+        get_catalog_cache()
+    except Exception as e:
+        # Missing or bad settings are reported by load_google_sheet once an order is started
+        logger.warning("Could not start warming the catalog: %s", e)
+    metrics = get_metrics()
+    
     # Main header
     st.markdown('<h1 class="main-header rtl">شركة المهندس لقطع غيار السيارات 🚗</h1>', unsafe_allow_html=True)
     
@@ -496,20 +2594,31 @@ def main():
     with col2:
         if st.button("🛒 طلبية جديدة", use_container_width=True, type="primary"):
             st.session_state.show_order_form = True
-            st.session_state.cart = {}
+            st.session_state.cart = Cart()
+            st.session_state.cart_token = None
             st.session_state.current_page = 1
+            st.query_params.pop(CART_QUERY_PARAM, None)
             st.rerun()
     
     if st.session_state.show_order_form:
-        processed_data_list = load_google_sheet()
+        with metrics.span("catalog"):
+            catalog = load_google_sheet()
         
-        if not processed_data_list:
+        if not catalog:
             st.error("لا يمكن تحميل البيانات من Google Sheets")
             return
             
-        # Convert to DataFrame for filtering
-        df_for_filtering = pd.DataFrame([item['data'] for item in processed_data_list if item['type'] == 'product'])
+        if st.session_state.get('cart_token'):
+            restore_saved_cart(catalog)
+            
+        # Bring cart prices in line with the catalog version being shown
+        removed_products = st.session_state.cart.reprice(catalog)
+        if removed_products:
+            st.warning(f"تمت إزالة {removed_products} منتج لم يعد متوفراً من الطلبية")
+        save_cart_to_url(st.session_state.cart)
         
+        display_bulk_order(catalog)
+            
         # Search functionality with filter options
         st.markdown('<div class="search-container">', unsafe_allow_html=True)
         col1, col2 = st.columns([3, 1])
@@ -519,46 +2628,59 @@ def main():
                                        value=st.session_state.search_query, 
                                        placeholder="ابحث عن قطعة غيار...")
         
+        ranked_search = st.checkbox("ترتيب النتائج حسب الأقرب للبحث", value=False,
+                                    help="يتحمل الأخطاء الإملائية ويعرض أفضل النتائج فقط")
+        
+        list_col, size_col = st.columns([3, 1])
+        with list_col:
+            continuous_list = st.toggle("📜 عرض متواصل", key="continuous_list",
+                                        help="تحميل المزيد من المنتجات أسفل القائمة بدلاً من التنقل بين الصفحات")
+        with size_col:
+            page_size = st.selectbox("عدد المنتجات في الصفحة", PAGE_SIZE_OPTIONS,
+                                     index=PAGE_SIZE_OPTIONS.index(PRODUCTS_PER_PAGE), key="page_size")
+        
+        # Origin counts for the active search come from its cached, unfiltered result set
+        search_facets = get_result_set(catalog, search_query, "الكل", ranked=ranked_search,
+                                       products_per_page=page_size)
+        origin_options = ["الكل"] + catalog.origin_options
+        if st.session_state.origin_filter not in origin_options:
+            st.session_state.origin_filter = "الكل"
         with col2:
-            origin_filter = st.selectbox("تصفية حسب المنشأ", 
-                                       ["الكل"] + list(df_for_filtering['المنشأ'].unique()))
+            # The counts change with the search, so the choice is restored from session state
+            origin_filter = st.selectbox(
+                "تصفية حسب المنشأ",
+                origin_options,
+                index=origin_options.index(st.session_state.origin_filter),
+                format_func=lambda origin: f"{origin} ({search_facets.origin_counts.get(origin, 0)})"
+                if origin != "الكل" else f"{origin} ({search_facets.product_count})"
+            )
+            st.session_state.origin_filter = origin_filter
         
         st.markdown('</div>', unsafe_allow_html=True)
         
-        # Filter data based on search and origin
-        filtered_products_list = []
-        for item in processed_data_list:
-            if item['type'] == 'product':
-                product = item['data']
-                match_search = True
-                match_origin = True
-                
-                if search_query:
-                    if search_query.lower() not in product['البند'].lower():
-                        match_search = False
-                        
-                if origin_filter and origin_filter != "الكل":
-                    if product['المنشأ'] != origin_filter:
-                        match_origin = False
-                        
-                if match_search and match_origin:
-                    filtered_products_list.append(item)
-            elif item['type'] == 'sub_category_separator':
-                filtered_products_list.append(item)
-                
-        # Group products by category with separators
-        grouped_products = group_products_by_category(filtered_products_list)
+        # Filter and group products by category, reusing earlier results for the same search
+        result_set = get_result_set(catalog, search_query, origin_filter, ranked=ranked_search,
+                                    products_per_page=page_size)
         
         # Show results count
-        product_count = len([item for item in grouped_products if item['type'] == 'product'])
-        st.markdown(f"**عدد النتائج: {product_count} منتج**")
+        st.markdown(f"**عدد النتائج: {result_set.product_count} منتج**")
+        
+        if len(result_set.category_pages) > 1:
+            st.selectbox(
+                "📂 الانتقال إلى فئة",
+                list(result_set.category_pages),
+                index=None,
+                key="category_jump",
+                placeholder="اختر فئة",
+                format_func=lambda category: f"{category} ({result_set.category_counts[category]})",
+                on_change=jump_to_category,
+                args=(result_set.category_pages,)
+            )
         
         # Pagination settings
-        items_per_page = 15
-        total_items = len(grouped_products)
-        total_pages = math.ceil(total_items / items_per_page) if total_items > 0 else 1
+        total_pages = result_set.page_count
         
-        if total_items == 0:
+        if result_set.product_count == 0:
             st.warning("لا توجد منتجات تطابق البحث")
             return
             
@@ -566,71 +2688,88 @@ def main():
         st.session_state.current_page = min(st.session_state.current_page, total_pages)
         st.session_state.current_page = max(st.session_state.current_page, 1)
         
-        # Calculate pagination
-        start_idx = (st.session_state.current_page - 1) * items_per_page
-        end_idx = min(start_idx + items_per_page, total_items)
-        current_items = grouped_products[start_idx:end_idx]
+        if continuous_list:
+            # A different search or page size starts the list from the top
+            list_search = (search_query, origin_filter, ranked_search, page_size)
+            if st.session_state.list_search != list_search:
+                st.session_state.list_search = list_search
+                st.session_state.list_pages = (1, 1)
+            # A catalog refresh may have shortened the results
+            first, last = st.session_state.list_pages
+            last = min(last, total_pages)
+            st.session_state.list_pages = (min(first, last), last)
+            st.markdown("### المنتجات")
+            products_area = st.container()
+            summary_slot = st.empty()
+            with products_area:
+                display_product_list(catalog, result_set, summary_slot)
+            display_cart_summary(catalog, summary_slot)
+            display_send_button(catalog)
+            return
+            
+        # Only the current page's slice is materialized
+        with metrics.span("paginate"):
+            current_items = result_set.page(st.session_state.current_page)
         
-        # Display products
+        # Display products; the summary slot is created up front so cards can refresh it
         st.markdown(f"### المنتجات ( {st.session_state.current_page}/{total_pages})")
-        display_products_table(current_items)
+        products_area = st.container()
+        pagination_area = st.container()
+        summary_slot = st.empty()
+        with products_area, metrics.span("render"):
+            display_products_table(catalog, current_items, summary_slot)
         
         # Pagination controls
         if total_pages > 1:
-            col1, col2, col3, col4, col5 = st.columns([1, 1, 2, 1, 1])
-            with col1:
-                if st.button("⏮️ الأولى", disabled=st.session_state.current_page == 1, use_container_width=True):
-                    navigate_to_page(1)
-            with col2:
-                if st.button("⬅️ السابقة", disabled=st.session_state.current_page == 1, use_container_width=True):
-                    navigate_to_page(st.session_state.current_page - 1)
-            with col3:
-                st.markdown(f'<div style="background: #bfdbfe; border-radius: 0.5rem; padding: 0.5rem; text-align: center;">{st.session_state.current_page}/{total_pages}</div>', 
-                          unsafe_allow_html=True)
-            with col4:
-                if st.button("التالية ➡️", disabled=st.session_state.current_page == total_pages, use_container_width=True):
-                    navigate_to_page(st.session_state.current_page + 1)
-            with col5:
-                if st.button("الأخيرة ⏭️", disabled=st.session_state.current_page == total_pages, use_container_width=True):
-                    navigate_to_page(total_pages)
+            with pagination_area:
+                col1, col2, col3, col4, col5 = st.columns([1, 1, 2, 1, 1])
+                with col1:
+                    if st.button("⏮️ الأولى", disabled=st.session_state.current_page == 1, use_container_width=True):
+                        navigate_to_page(1)
+                with col2:
+                    if st.button("⬅️ السابقة", disabled=st.session_state.current_page == 1, use_container_width=True):
+                        navigate_to_page(st.session_state.current_page - 1)
+                with col3:
+                    st.markdown(f'<div style="background: #bfdbfe; border-radius: 0.5rem; padding: 0.5rem; text-align: center;">{st.session_state.current_page}/{total_pages}</div>', 
+                              unsafe_allow_html=True)
+                with col4:
+                    if st.button("التالية ➡️", disabled=st.session_state.current_page == total_pages, use_container_width=True):
+                        navigate_to_page(st.session_state.current_page + 1)
+                with col5:
+                    if st.button("الأخيرة ⏭️", disabled=st.session_state.current_page == total_pages, use_container_width=True):
+                        navigate_to_page(total_pages)
         
         # Order summary and review
-        if st.session_state.cart:
-            st.markdown("---")
-            total_items, total_cost = get_cart_summary()
-            
-            # Summary cards
-            col1, col2 = st.columns(2)
-            with col1:
-                st.markdown(f"""
-                <div class="summary-card">
-                    <div class="summary-title">📦 عدد الأصناف</div>
-                    <div class="stat-number">{total_items}</div>
-                </div>
-                """, unsafe_allow_html=True)
-            with col2:
-                st.markdown(f"""
-                <div class="summary-card">
-                    <div class="summary-title">💰 الإجمالي</div>
-                    <div class="stat-number">{total_cost}</div>
-                    <div class="stat-label">جنيه مصري</div>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            # Order details
-            display_order_details()
-            
-            # WhatsApp send button
-            st.markdown("---")
-            col1, col2, col3 = st.columns([1, 2, 1])
-            with col2:
-                whatsapp_number = st.secrets["whatsapp"]["number"]
-                whatsapp_message = generate_whatsapp_message()
-                whatsapp_url = f"https://wa.me/{whatsapp_number}?text={whatsapp_message}"
-                st.markdown(
-                    f'<a href="{whatsapp_url}" target="_blank" class="whatsapp-btn">📱 إرسال الطلبية عبر واتساب</a>',
-                    unsafe_allow_html=True
-                )
+        display_cart_summary(catalog, summary_slot)
+        display_send_button(catalog)
+
+def display_debug_panel(metrics: Metrics, spans: List[tuple], total_seconds: float):
+    """Show this rerun's stage timings and the process-wide percentiles and counters"""
+    with st.expander("🛠️ Debug"):
+        st.markdown(f"**Rerun: {total_seconds * 1000:.1f} ms**")
+        st.table([{"stage": stage, "ms": round(seconds * 1000, 2)} for stage, seconds in spans])
+        st.table([
+            {"stage": stage, "p50 ms": round(p50 * 1000, 2), "p95 ms": round(p95 * 1000, 2),
+             "p99 ms": round(p99 * 1000, 2), "samples": samples}
+            for stage, (p50, p95, p99, samples) in sorted(metrics.percentiles().items())
+        ])
+        st.json(metrics.counters())
+
+def main():
+    metrics = get_metrics()
+    metrics.begin_rerun()
+    started = time.perf_counter()
+    try:
+        render_order_page()
+    finally:
+        total_seconds = time.perf_counter() - started
+        spans = metrics.end_rerun()
+        log_rerun("rerun", total_seconds, spans)
+        
+    # Admins open the app with ?debug=<admin_key> to see where the time goes
+    admin_key = read_metrics_settings().get("admin_key")
+    if admin_key and st.query_params.get("debug") == admin_key:
+        display_debug_panel(metrics, spans, total_seconds)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,47 @@
+"""Generate realistic Arabic spare-parts catalogs shaped like the Google Sheet"""
+import random
+from typing import List
+
+HEADERS = ["الفئة", "البند", "المنشأ", "السعر"]
+
+CATEGORIES = [
+    "فلاتر زيت", "فلاتر هواء", "فلاتر بنزين", "بواجي", "تيل فرامل", "طنابير", "سيور", "رولمان بلي",
+    "مساعدين", "مقصات", "كبالن", "ردياتير", "طرمبة مياه", "طرمبة بنزين", "كويلات", "حساسات",
+    "لمبات", "مرايات", "اكصدامات", "جوانات", "مكن", "دبرياج", "عفشة", "كاوتش"
+]
+PART_WORDS = ["أمامي", "خلفي", "يمين", "شمال", "أصلي", "كامل", "طقم", "علوي", "سفلي", "داخلي", "خارجي"]
+MODELS = ["تويوتا كورولا", "هيونداي النترا", "نيسان صني", "كيا سيراتو", "شيفروليه أفيو", "ميتسوبيشي لانسر",
+          "رينو لوجان", "سكودا أوكتافيا", "بيجو 301", "فيات تيبو", "سوزوكي سويفت", "هوندا سيفيك"]
+ORIGINS = ["ياباني", "كوري", "صيني", "ألماني", "تايواني", "تركي", "مصري", "أصلي وكالة"]
+
+
+def generate_sheet_values(rows: int, seed: int = 0, blank_every: int = 40) -> List[List[str]]:
+    """Return worksheet values: a header row then ``rows`` products grouped by category.
+
+    Roughly one row in ``blank_every`` is blank, like the sub-category gaps in
+    the real sheet, and a few prices are written the way people type them
+    ("1,250", "٣٥٠ ج.م").
+    """
+    rnd = random.Random(seed)
+    values = [list(HEADERS)]
+    categories_used = max(1, min(len(CATEGORIES) * 8, rows // 50))
+    for index in range(rows):
+        category_number = index * categories_used // rows
+        category = CATEGORIES[category_number % len(CATEGORIES)]
+        if category_number >= len(CATEGORIES):
+            category = f"{category} {category_number // len(CATEGORIES) + 1}"
+        if index and rnd.randrange(blank_every) == 0:
+            values.append(["", "", "", ""])
+            
+        name = (f"{category} {rnd.choice(MODELS)} {rnd.choice(PART_WORDS)} "
+                f"{rnd.choice('ABCDEFGHKMNPRST')}{rnd.randint(100, 99999)}")
+        price = rnd.randint(15, 25000)
+        style = rnd.random()
+        if style < 0.9:
+            price_text = str(price)
+        elif style < 0.95:
+            price_text = f"{price:,}"
+        else:
+            price_text = str(price).translate(str.maketrans("0123456789", "٠١٢٣٤٥٦٧٨٩")) + " ج.م"
+        values.append([category, name, rnd.choice(ORIGINS), price_text])
+    return values
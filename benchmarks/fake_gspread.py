@@ -0,0 +1,43 @@
+"""In-memory stand-in for the parts of the gspread client the app uses"""
+from typing import Dict, List
+
+
+class FakeWorksheet:
+    def __init__(self, title: str, values: List[List[str]]):
+        self.title = title
+        self._values = values
+
+    def get_all_values(self) -> List[List[str]]:
+        # gspread returns fresh lists on every call
+        return [list(row) for row in self._values]
+
+    def append_row(self, row: List, value_input_option: str = 'RAW'):
+        self._values.append(list(row))
+
+    def append_rows(self, rows: List[List], value_input_option: str = 'RAW'):
+        self._values.extend(list(row) for row in rows)
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheets: Dict[str, List[List[str]]]):
+        self._worksheets = [FakeWorksheet(title, values) for title, values in worksheets.items()]
+
+    @property
+    def sheet1(self) -> FakeWorksheet:
+        return self._worksheets[0]
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise KeyError(title)
+
+
+class FakeClient:
+    """Client serving spreadsheets from ``{sheet_id: {worksheet title: values}}``"""
+
+    def __init__(self, spreadsheets: Dict[str, Dict[str, List[List[str]]]]):
+        self._spreadsheets = spreadsheets
+
+    def open_by_key(self, sheet_id: str) -> FakeSpreadsheet:
+        return FakeSpreadsheet(self._spreadsheets[sheet_id])
@@ -0,0 +1,209 @@
+"""Drive many simulated customer sessions through the app and report latency and memory.
+
+Usage::
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --sessions 50 --processes 4 --rows 50000
+    python benchmarks/load_test.py --json results.json
+
+Each session is a headless Streamlit AppTest of ``app.py`` with test secrets
+and a synthetic catalog served by the in-memory gspread stand-in. It opens
+the app, starts an order, searches, pages, adds and removes products.
+
+AppTest can only run one script at a time per process. Each worker process
+therefore keeps its share of the sessions open and interleaves their reruns,
+so the sessions share that process's caches as they would on a server. Run
+several workers to load several cores.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+import numpy as np
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest
+
+from catalog_generator import generate_sheet_values
+from fake_gspread import FakeClient
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+QUERIES = ["فلاتر", "تيل كورولا", "بواجي", "مساعدين النترا", "سيور", "طرمبة", "كبالن صني"]
+NEXT_PAGE_LABEL = "التالية ➡️"
+RERUN_TIMEOUT_SECONDS = 120
+
+
+def share_script_cache():
+    """Compile the app once for all sessions, like the server's single script cache.
+
+    AppTest otherwise recompiles the script on every run, which would be
+    counted as rerun latency.
+    """
+    get_bytecode = ScriptCache.get_bytecode
+    shared_cache = ScriptCache()
+    return mock.patch.object(ScriptCache, "get_bytecode",
+                             lambda self, script_path: get_bytecode(shared_cache, script_path))
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current RSS, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def new_session(data_dir: str) -> AppTest:
+    at = AppTest.from_file(APP_PATH, default_timeout=RERUN_TIMEOUT_SECONDS)
+    at.secrets["gcp_service_account"] = {"type": "service_account"}
+    at.secrets["google"] = {"sheet_id": "load-test"}
+    at.secrets["whatsapp"] = {"number": "201000000000"}
+    at.secrets["catalog"] = {"snapshot_path": os.path.join(data_dir, "catalog_snapshot.sqlite")}
+    at.secrets["orders"] = {"log_path": os.path.join(data_dir, "orders.sqlite")}
+    # Per-rerun log lines would flood the output
+    at.secrets["metrics"] = {"log_level": "WARNING"}
+    return at
+
+
+def quantity_buttons(at: AppTest, prefix: str) -> list:
+    return [button for button in at.button if (button.key or "").startswith(prefix)]
+
+
+def session_steps(at: AppTest, seed: int):
+    """Yield (step name, action) pairs for one customer's visit, each action one rerun"""
+    rnd = random.Random(seed)
+    yield "open", at.run
+    yield "new_order", lambda: at.button[0].click().run()
+    for _ in range(2):
+        query = rnd.choice(QUERIES)
+        yield "search", lambda: at.text_input[0].input(query).run()
+        plus = quantity_buttons(at, "plus_")
+        for key in [button.key for button in rnd.sample(plus, min(3, len(plus)))]:
+            yield "add", lambda: at.button(key=key).click().run()
+    yield "clear_search", lambda: at.text_input[0].input("").run()
+    for _ in range(2):
+        next_page = [button for button in at.button if button.label == NEXT_PAGE_LABEL and not button.disabled]
+        if next_page:
+            yield "next_page", next_page[0].click().run
+    plus = quantity_buttons(at, "plus_")
+    if plus:
+        key = rnd.choice(plus).key
+        yield "add", lambda: at.button(key=key).click().run()
+        yield "remove", lambda: at.button(key=key.replace("plus_", "minus_")).click().run()
+
+
+def run_worker(rows: int, sessions: int, first_seed: int) -> dict:
+    """Run ``sessions`` interleaved sessions in this process and return their timings and RSS"""
+    values = generate_sheet_values(rows)
+    data_dir = tempfile.mkdtemp(prefix="load-test-")
+    timings = []
+    with mock.patch("gspread.authorize", return_value=FakeClient({"load-test": {"Sheet1": values}})), \
+            mock.patch("google.oauth2.service_account.Credentials.from_service_account_info",
+                       return_value=object()), \
+            share_script_cache():
+        # One warm-up visit loads the shared catalog and caches before measuring
+        warmup = new_session(data_dir)
+        for _, action in session_steps(warmup, seed=-1):
+            action()
+        gc.collect()
+        rss_before = rss_bytes()
+
+        open_sessions = [(new_session(data_dir), first_seed + number) for number in range(sessions)]
+        open_sessions = [(at, session_steps(at, seed)) for at, seed in open_sessions]
+        started = time.perf_counter()
+        while open_sessions:
+            # One rerun per open session in turn, until every visit is over
+            for at, visit in list(open_sessions):
+                try:
+                    name, action = next(visit)
+                except StopIteration:
+                    open_sessions.remove((at, visit))
+                    continue
+                step_started = time.perf_counter()
+                try:
+                    action()
+                    failed = bool(at.exception)
+                except (IndexError, KeyError):
+                    # The element to interact with is missing, so an earlier rerun went wrong
+                    failed = True
+                timings.append((name, time.perf_counter() - step_started, failed))
+        wall_seconds = time.perf_counter() - started
+        gc.collect()
+        rss_after = rss_bytes()
+    return {"timings": timings, "wall_seconds": wall_seconds, "rss_before": rss_before, "rss_after": rss_after}
+
+
+def percentiles_ms(samples: list) -> dict:
+    values = np.array(samples) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]).tolist()
+    return {"p50": round(p50, 1), "p95": round(p95, 1), "p99": round(p99, 1),
+            "max": round(float(values.max()), 1), "count": len(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20, help="simulated customers in total")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes sharing the sessions")
+    parser.add_argument("--rows", type=int, default=10000, help="catalog size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    shares = [args.sessions // args.processes + (worker < args.sessions % args.processes)
+              for worker in range(args.processes)]
+    seeds = np.cumsum([args.seed] + shares[:-1]).tolist()
+    if args.processes == 1:
+        workers = [run_worker(args.rows, shares[0], seeds[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            workers = list(executor.map(run_worker, [args.rows] * args.processes, shares, seeds))
+    # The measured phase of the slowest worker, leaving out start-up and warm-up
+    wall_seconds = max(worker["wall_seconds"] for worker in workers)
+
+    timings = [timing for worker in workers for timing in worker["timings"]]
+    by_step = {}
+    for name, seconds, _ in timings:
+        by_step.setdefault(name, []).append(seconds)
+    rss_growth = sum(worker["rss_after"] - worker["rss_before"] for worker in workers)
+    report = {
+        "sessions": args.sessions,
+        "processes": args.processes,
+        "rows": args.rows,
+        "reruns": len(timings),
+        "failed_reruns": sum(failed for _, _, failed in timings),
+        "wall_seconds": round(wall_seconds, 2),
+        "reruns_per_second": round(len(timings) / wall_seconds, 2),
+        "latency_ms": percentiles_ms([seconds for _, seconds, _ in timings]),
+        "latency_ms_by_step": {name: percentiles_ms(samples) for name, samples in by_step.items()},
+        "rss_before_mb": [round(worker["rss_before"] / 2 ** 20, 1) for worker in workers],
+        "rss_after_mb": [round(worker["rss_after"] / 2 ** 20, 1) for worker in workers],
+        "rss_growth_per_session_kb": round(rss_growth / args.sessions / 1024, 1),
+    }
+
+    print(f"{report['sessions']} sessions in {report['processes']} process(es), {args.rows:,} catalog rows")
+    print(f"{report['reruns']} reruns ({report['failed_reruns']} failed) in {report['wall_seconds']} s"
+          f" = {report['reruns_per_second']} reruns/s")
+    print(f"{'step':<14}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'n':>6}   (ms)")
+    for name, latency in [("all", report["latency_ms"])] + list(report["latency_ms_by_step"].items()):
+        print(f"{name:<14}{latency['p50']:>9}{latency['p95']:>9}{latency['p99']:>9}"
+              f"{latency['max']:>9}{latency['count']:>6}")
+    print(f"RSS per process {report['rss_before_mb']} MB -> {report['rss_after_mb']} MB,"
+          f" {report['rss_growth_per_session_kb']} KB per session")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
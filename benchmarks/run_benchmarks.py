@@ -0,0 +1,177 @@
+"""Time the catalog pipeline on synthetic catalogs.
+
+Usage::
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 --repeat 5
+    python benchmarks/run_benchmarks.py --save benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json
+
+Every stage runs against worksheets served by an in-memory gspread stand-in,
+so no network access or credentials are needed. Timings are medians of
+``--repeat`` runs, in milliseconds.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from dataclasses import replace
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+# Importing the app outside `streamlit run` logs bare-mode warnings
+logging.disable(logging.WARNING)
+import app  # noqa: E402
+logging.disable(logging.NOTSET)
+
+from catalog_generator import generate_sheet_values  # noqa: E402
+from fake_gspread import FakeClient  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 50000, 200000]
+# (label, query, origin filter, ranked)
+SEARCHES = [
+    ("filter_all", "", "الكل", False),
+    ("filter_word", "فلاتر", "الكل", False),
+    ("filter_words_origin", "تيل كورولا", "ياباني", False),
+    ("filter_ranked_typo", "بوجي سيفك", "الكل", True),
+]
+CART_PRODUCTS = 200
+# A benchmark this much slower than the baseline is reported as a regression
+REGRESSION_RATIO = 1.2
+
+
+def measure(fn, repeat: int) -> dict:
+    """Run ``fn`` ``repeat`` times and return its median and best time in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(samples), 3), "min_ms": round(min(samples), 3)}
+
+
+def fill_cart(catalog: app.Catalog, product_ids: np.ndarray) -> app.Cart:
+    cart = app.Cart()
+    for quantity, product_id in enumerate(product_ids.tolist(), start=1):
+        cart.update(catalog, product_id, quantity % 7 + 1)
+    return cart
+
+
+def bench_size(rows: int, repeat: int) -> dict:
+    """Time every pipeline stage on a catalog of ``rows`` products"""
+    values = generate_sheet_values(rows)
+    client = FakeClient({"bench": {"Sheet1": values}})
+    guard = app.SheetsQuotaGuard(requests_per_minute=1e9, burst=10 ** 9)
+    results = {}
+
+    results["fetch"] = measure(lambda: app.fetch_sheet_values(client, guard, "bench"), repeat)
+    results["parse"] = measure(lambda: app.parse_sheet_values(values), repeat)
+    catalog = app.parse_sheet_values(values)
+    results["search_index"] = measure(lambda: app.SearchIndex(catalog.names.tolist()), repeat)
+    # The app builds these lazy lookups off the request path, so they stay out of the timed stages
+    catalog.search_index.warm()
+    catalog.sku_hashes
+
+    for label, query, origin, ranked in SEARCHES:
+        normalized = app.normalize_search_text(query)
+        # An empty result would only time the no-match path
+        assert len(app.filter_products(catalog, normalized, origin, ranked=ranked)), f"{label} matched nothing"
+        results[label] = measure(lambda: app.filter_products(catalog, normalized, origin, ranked=ranked), repeat)
+
+    all_ids = np.arange(len(catalog), dtype=np.int32)
+    results["group"] = measure(lambda: app.group_products_by_category(catalog, all_ids), repeat)
+    grouped = app.group_products_by_category(catalog, all_ids).astype(np.int32)
+    results["paginate"] = measure(lambda: app.compute_page_starts(grouped), repeat)
+
+    page_starts = app.compute_page_starts(grouped)
+    page = grouped[page_starts[len(page_starts) // 2]:][:app.PRODUCTS_PER_PAGE * 2]
+    page_ids = page[page >= 0][:app.PRODUCTS_PER_PAGE].tolist()
+    results["render_page_html"] = measure(
+        lambda: [app.render_product_card_html(catalog.names[i], catalog.origin(i), catalog.prices[i], 2)
+                 for i in page_ids],
+        repeat
+    )
+
+    cart_ids = np.linspace(0, len(catalog) - 1, min(CART_PRODUCTS, len(catalog))).astype(np.int64)
+    results["cart_fill"] = measure(lambda: fill_cart(catalog, cart_ids), repeat)
+    cart = fill_cart(catalog, cart_ids)
+    # A new version without a diff forces the full re-key by SKU
+    repriced = app.parse_sheet_values(values)
+    repriced = replace(repriced, version=repriced.version + "-next")
+    repriced.sku_ids
+
+    def reprice():
+        cart.catalog_version = catalog.version
+        cart.reprice(repriced)
+        return cart.total_items, cart.total_cost
+
+    results["cart_reprice_summary"] = measure(reprice, repeat)
+
+    results["message"] = measure(lambda: app.build_whatsapp_messages(cart, repriced), repeat)
+
+    # A pasted part list: every other line drops its last word, so it needs a ranked match
+    bulk_lines = [catalog.names[i] if n % 2 else catalog.names[i].rsplit(' ', 1)[0]
+                  for n, i in enumerate(cart_ids.tolist())]
+    bulk_text = "\n".join(f"{name} {n % 5 + 1}" for n, name in enumerate(bulk_lines))
+    results["bulk_order_match"] = measure(
+        lambda: app.match_bulk_order(catalog, app.parse_bulk_order(bulk_text, catalog.search_index)[0]),
+        repeat
+    )
+    return results
+
+
+def print_results(results: dict, baseline: dict = None):
+    for rows, stages in results.items():
+        print(f"\n{int(rows):,} rows")
+        for stage, timing in stages.items():
+            line = f"  {stage:<24}{timing['median_ms']:>12.3f} ms"
+            previous = (baseline or {}).get(rows, {}).get(stage)
+            if previous and previous["median_ms"] > 0:
+                ratio = timing["median_ms"] / previous["median_ms"]
+                flag = "  SLOWER" if ratio > REGRESSION_RATIO else ""
+                line += f"   x{ratio:.2f} vs baseline{flag}"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="catalog sizes in rows")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    for rows in args.sizes:
+        results[str(rows)] = bench_size(rows, args.repeat)
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "meta": {
+                    "date": datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "machine": platform.machine(),
+                    "repeat": args.repeat,
+                },
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
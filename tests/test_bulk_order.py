@@ -0,0 +1,42 @@
+"""Parsing and matching pasted part lists"""
+import logging
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Importing the app outside `streamlit run` logs bare-mode warnings
+logging.disable(logging.WARNING)
+import app  # noqa: E402
+logging.disable(logging.NOTSET)
+
+HEADERS = ["الفئة", "البند", "المنشأ", "السعر"]
+CATALOG = app.parse_sheet_values([
+    HEADERS,
+    ["تيل فرامل", "تيل فرامل بيجو 301", "فرنسي", "350"],
+    ["تيل فرامل", "تيل فرامل بيجو 508", "فرنسي", "420"],
+    ["فلاتر", "فلتر زيت كورولا", "ياباني", "100"],
+])
+
+
+def test_name_ending_in_a_number_is_taken_whole():
+    rows, skipped = app.parse_bulk_order("تيل فرامل بيجو 301\nتيل فرامل بيجو 508 x 2", CATALOG.search_index)
+    assert rows == [(1, "تيل فرامل بيجو 301", 1), (2, "تيل فرامل بيجو 508", 2)]
+    assert skipped == []
+
+    matched, unmatched = app.match_bulk_order(CATALOG, rows)
+    assert [(quantity, product_id) for _, _, quantity, product_id in matched] == [(1, 0), (2, 1)]
+    assert unmatched == []
+
+
+def test_trailing_number_is_a_quantity_when_the_line_is_not_a_name():
+    rows, _ = app.parse_bulk_order("فلتر زيت كورولا 3\n٢ × فلتر زيت كورولا", CATALOG.search_index)
+    assert rows == [(1, "فلتر زيت كورولا", 3), (2, "فلتر زيت كورولا", 2)]
+
+
+def test_zero_quantity_lines_are_listed_as_skipped():
+    rows, skipped = app.parse_bulk_order("البند;الكمية\nفلتر زيت كورولا;0\nفلتر زيت كورولا 0\nتيل فرامل بيجو 508;1",
+                                         CATALOG.search_index)
+    assert rows == [(4, "تيل فرامل بيجو 508", 1)]
+    assert skipped == [(2, "فلتر زيت كورولا;0"), (3, "فلتر زيت كورولا 0")]
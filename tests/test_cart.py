@@ -0,0 +1,46 @@
+"""Cart totals across catalog refreshes"""
+import logging
+import os
+import sys
+from dataclasses import replace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Importing the app outside `streamlit run` logs bare-mode warnings
+logging.disable(logging.WARNING)
+import app  # noqa: E402
+logging.disable(logging.NOTSET)
+
+HEADERS = ["الفئة", "البند", "المنشأ", "السعر"]
+# The same part listed under two categories has one SKU
+ROWS = [
+    ["فلاتر", "فلتر زيت كورولا", "ياباني", "100"],
+    ["عروض", "فلتر زيت كورولا", "ياباني", "100"],
+    ["بواجي", "بوجي سيفيك", "كوري", "40"],
+]
+
+
+def assert_totals_match_lines(cart):
+    assert cart.total_items == sum(entry.quantity for entry in cart)
+    assert cart.total_cents == sum(entry.quantity * app.minor_units(entry.price) for entry in cart)
+
+
+@pytest.mark.parametrize("with_diff", [True, False])
+def test_reprice_merges_duplicate_rows(with_diff):
+    old = app.parse_sheet_values([HEADERS] + ROWS)
+    cart = app.Cart()
+    cart.update(old, 0, 2)
+    cart.update(old, 1, 3)
+    assert (len(cart), cart.total_items, cart.total_cost) == (2, 5, 500)
+
+    new = app.parse_sheet_values([HEADERS] + ROWS + [["بواجي", "بوجي لانسر", "كوري", "45"]])
+    new = app.derive_catalog(old, new) if with_diff else replace(new, version=new.version + "-next")
+    assert cart.reprice(new) == 0
+
+    assert len(cart) == 1
+    assert cart.quantity(0) == 5
+    assert (cart.total_items, cart.total_cost) == (5, 500)
+    assert_totals_match_lines(cart)
@@ -0,0 +1,84 @@
+"""Catalog cache refreshes when one of several sources fails"""
+import logging
+import os
+import sys
+import time
+from unittest import mock
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# Importing the app outside `streamlit run` logs bare-mode warnings
+logging.disable(logging.WARNING)
+import app  # noqa: E402
+logging.disable(logging.NOTSET)
+
+from catalog_generator import generate_sheet_values  # noqa: E402
+from fake_gspread import FakeClient  # noqa: E402
+
+TAB_A = generate_sheet_values(100, seed=1)
+TAB_B = generate_sheet_values(100, seed=2)
+
+
+@pytest.fixture
+def catalog_cache(tmp_path):
+    """Open a fresh catalog cache over tabs A and B, seeded from a complete snapshot"""
+    snapshot_path = str(tmp_path / "catalog_snapshot.sqlite")
+    full = app.merge_catalogs([app.parse_sheet_values(TAB_A), app.parse_sheet_values(TAB_B)])
+    app.save_catalog_snapshot(snapshot_path, full)
+    secrets = {
+        "gcp_service_account": {},
+        "google": {"sheet_id": "shop", "worksheets": ["A", "B"]},
+        "catalog": {"snapshot_path": snapshot_path}
+    }
+    client = FakeClient({"shop": {"A": TAB_A}})
+    app.get_catalog_cache.clear()
+    with mock.patch.object(app.st, "secrets", secrets), \
+            mock.patch.object(app, "authorize_sheets_client", return_value=client):
+        yield app.get_catalog_cache(), snapshot_path
+    app.get_catalog_cache.clear()
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_missing_source_after_restart_keeps_snapshot(catalog_cache):
+    cache, snapshot_path = catalog_cache
+    assert len(cache.get()) == 200
+
+    # Tab B fails on the first fetch of the new process, with no last good copy
+    wait_for(lambda: cache.failures)
+    assert len(cache.get()) == 200
+    assert len(app.load_catalog_snapshot(snapshot_path)) == 200
+
+    cart = app.Cart()
+    catalog = cache.get()
+    cart.update(catalog, 0, 1)
+    cart.update(catalog, 150, 1)
+    assert cart.reprice(cache.get()) == 0
+    assert len(cart) == 2
+
+
+def test_require_all_only_refuses_sources_without_a_copy():
+    spreadsheets = {"shop": {"A": TAB_A}}
+    sources = [("shop", "A"), ("shop", "B")]
+    guard, metrics = app.SheetsQuotaGuard(requests_per_minute=6000, burst=100), app.Metrics()
+    last_good = {}
+    with mock.patch.object(app, "authorize_sheets_client", side_effect=lambda _: FakeClient(spreadsheets)):
+        with pytest.raises(KeyError):
+            app.fetch_catalog({}, sources, guard, metrics, last_good, require_all=True)
+        assert len(app.fetch_catalog({}, sources, guard, metrics, last_good)) == 100
+
+        spreadsheets["shop"]["B"] = TAB_B
+        assert len(app.fetch_catalog({}, sources, guard, metrics, last_good, require_all=True)) == 200
+
+        # Once B has a last good copy, its failure no longer blocks the refresh
+        del spreadsheets["shop"]["B"]
+        assert len(app.fetch_catalog({}, sources, guard, metrics, last_good, require_all=True)) == 200
@@ -0,0 +1,45 @@
+"""Rerun timing of fragments"""
+import logging
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Importing the app outside `streamlit run` logs bare-mode warnings
+logging.disable(logging.WARNING)
+import app  # noqa: E402
+logging.disable(logging.NOTSET)
+
+
+def test_fragment_rerun_is_timed_and_logged(monkeypatch, caplog):
+    metrics = app.Metrics()
+    monkeypatch.setattr(app, "get_metrics", lambda: metrics)
+    app.st.session_state.cart = app.Cart()
+
+    @app.timed_fragment
+    def fragment():
+        with metrics.span("render"):
+            return "drawn"
+
+    with caplog.at_level(logging.INFO, logger="app"):
+        assert fragment() == "drawn"
+    assert metrics.percentiles()["fragment"][3] == 1
+    assert '"event": "fragment"' in caplog.text
+    assert '["render"' in caplog.text
+    assert not metrics.in_rerun
+
+
+def test_fragment_inside_full_rerun_is_left_to_main(monkeypatch):
+    metrics = app.Metrics()
+    monkeypatch.setattr(app, "get_metrics", lambda: metrics)
+
+    @app.timed_fragment
+    def fragment():
+        with metrics.span("render"):
+            pass
+
+    metrics.begin_rerun()
+    fragment()
+    assert [stage for stage, _ in metrics.end_rerun()] == ["render"]
+    assert "fragment" not in metrics.percentiles()
@@ -0,0 +1,116 @@
+"""Order log and sheet sync against an in-memory worksheet"""
+import logging
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# Importing the app outside `streamlit run` logs bare-mode warnings
+logging.disable(logging.WARNING)
+import app  # noqa: E402
+logging.disable(logging.NOTSET)
+
+from catalog_generator import generate_sheet_values  # noqa: E402
+from fake_gspread import FakeWorksheet  # noqa: E402
+
+
+class QuotaExceeded(Exception):
+    """Shaped like gspread's APIError for a 429 response"""
+
+    class response:
+        status_code = 429
+
+
+class FlakyWorksheet(FakeWorksheet):
+    """Worksheet whose first ``failures`` appends are refused with a 429"""
+
+    def __init__(self, failures: int):
+        super().__init__("Orders", [list(app.ORDERS_WORKSHEET_HEADERS)])
+        self.failures = failures
+        self.attempts = 0
+
+    def append_rows(self, rows, value_input_option='RAW'):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise QuotaExceeded("429: Quota exceeded")
+        super().append_rows(rows, value_input_option)
+
+
+@pytest.fixture
+def catalog():
+    return app.parse_sheet_values(generate_sheet_values(200, seed=1))
+
+
+@pytest.fixture
+def order_log(tmp_path):
+    return app.OrderLog(str(tmp_path / "orders.sqlite"))
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(app, "SHEETS_BACKOFF_BASE_SECONDS", 0.0)
+
+
+def make_cart(catalog, *product_ids):
+    cart = app.Cart()
+    for product_id in product_ids:
+        cart.update(catalog, product_id, 2)
+    return cart
+
+
+def test_quota_error_keeps_order_pending_until_append_succeeds(catalog, order_log):
+    cart = make_cart(catalog, 0, 5)
+    order_log.record(cart, catalog)
+    worksheet = FlakyWorksheet(failures=1)
+    sync = app.OrderSheetSync(order_log, lambda: worksheet, app.SheetsQuotaGuard(max_retries=0),
+                              settle_seconds=0)
+
+    pending = order_log.pending(float("inf"))
+    assert [(order[0], order[1]) for order in pending] == [(cart.order_id, 1)]
+
+    with pytest.raises(app.SheetsThrottled):
+        sync.sync_once()
+    assert [order[0] for order in order_log.pending(float("inf"))] == [cart.order_id]
+    assert len(worksheet.get_all_values()) == 1
+
+    assert sync.sync_once() == 1
+    assert order_log.pending(float("inf")) == []
+    rows = worksheet.get_all_values()
+    assert len(rows) == 2
+    assert rows[1][:2] == [cart.order_id, 1]
+    assert sync.sync_once() == 0
+
+
+def test_guard_retries_quota_error_within_one_sync(catalog, order_log):
+    cart = make_cart(catalog, 3)
+    order_log.record(cart, catalog)
+    worksheet = FlakyWorksheet(failures=1)
+    guard = app.SheetsQuotaGuard(max_retries=1)
+    sync = app.OrderSheetSync(order_log, lambda: worksheet, guard, settle_seconds=0)
+
+    assert sync.sync_once() == 1
+    assert worksheet.attempts == 2
+    assert guard.retries == 1
+    assert order_log.pending(float("inf")) == []
+
+
+def test_edit_after_sync_is_pending_again(catalog, order_log):
+    cart = make_cart(catalog, 0)
+    order_log.record(cart, catalog)
+    order_log.mark_synced([(cart.order_id, 1)])
+    assert order_log.pending(float("inf")) == []
+
+    cart.update(catalog, 7, 1)
+    order_log.record(cart, catalog)
+    pending = order_log.pending(float("inf"))
+    assert [(order[0], order[1], order[3]) for order in pending] == [(cart.order_id, 2, 3)]
+
+    # A late acknowledgement of the older revision must not hide the edit
+    order_log.mark_synced([(cart.order_id, 1)])
+    assert len(order_log.pending(float("inf"))) == 1
+    order_log.mark_synced([(cart.order_id, 2)])
+    assert order_log.pending(float("inf")) == []